@@ -11,7 +11,21 @@ ds['tmp'] = ds['phi'] - ds['phi_0']
 ds['to_be_integrated'] = 0.5*(ds['tmp'].differentiate('x')**2 + ds['tmp'].differentiate('z')**2 )
 ds['K'] = ds['to_be_integrated'].integrate(('x', 'z'))
 
+# energy of the mean flow v_z = -d(phi_0)/dx
+ds['M'] = (0.5*ds['phi_0'].differentiate('x')**2).integrate('x')
+
+# Nusselt number 1 + <n v_x>/kappa with v_x = d(phi)/dz, kappa from BOUT.inp
+kappa = 1.6e-3
+ds['Nu'] = 1 + (ds['n']*ds['phi'].differentiate('z')).integrate(('x', 'z'))/kappa
+
 K = ds['K'].values
 time = ds['t'].values
+# restarted runs can leave gaps in the output times; spectrum() in
+# support_functions.py then uses a Lomb-Scargle estimate instead of Welch
+spacing = np.diff(time)
+if not np.allclose(spacing, spacing.mean(), rtol=1e-6, atol=0):
+    print(f"warning: non-uniform time axis, spacing from {spacing.min()} to {spacing.max()}")
 np.save('K_1.6e-3_data', K)
 np.save('time_1.6e-3_data', time)
+np.save('M_1.6e-3_data', ds['M'].values)
+np.save('Nu_1.6e-3_data', ds['Nu'].values)
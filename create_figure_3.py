@@ -1,26 +1,20 @@
 import matplotlib.pyplot as plt
 import numpy as np
 from scipy import signal
-import cosmoplots
 from support_functions import *
 import superposedpulses.forcing as frc
-import superposedpulses.point_model as pm
 import superposedpulses.pulse_shape as ps
+import cosmoplots
 from scipy.signal import find_peaks
-
-axes_size = cosmoplots.set_rcparams_dynamo(plt.rcParams, num_cols=1, ls="thin")
-
-fig_PSD = plt.figure()
-ax1 = fig_PSD.add_axes(axes_size)
-fig_AC = plt.figure()
-ax2 = fig_AC.add_axes(axes_size)
+from figure_pipeline import Pipeline, add_realization_branch
 
 
 class AsymLaplaceAmp(frc.ForcingGenerator):
     def __init__(self, control_parameter):
         self.control_parameter = control_parameter
 
-    def get_forcing(self, times: np.ndarray, gamma: float) -> frc.Forcing:
+    def get_forcing(self, times: np.ndarray, gamma: float, rng=None) -> frc.Forcing:
+        rng = np.random.default_rng(rng)
         total_pulses = int(max(times) * gamma)
         arrival_time_indx = (
             np.arange(start=0, stop=99994, step=5) * 100
@@ -32,6 +26,7 @@ class AsymLaplaceAmp(frc.ForcingGenerator):
             ),
             kappa=self.control_parameter,
             size=total_pulses,
+            seed=rng.integers(2**32),
         )
         durations = np.ones(shape=total_pulses)
         return frc.Forcing(
@@ -48,46 +43,72 @@ class AsymLaplaceAmp(frc.ForcingGenerator):
         pass
 
 
-model = pm.PointModel(gamma=0.2, total_duration=100000, dt=0.01)
-model.set_pulse_shape(ps.LorentzShortPulseGenerator(tolerance=1e-5))
-
-plot_colors = ["tab:blue", "tab:orange", "tab:green", "tab:red"]
-
-for control_parameter, color in zip([0.2, 0.4, 0.45, 0.48], plot_colors):
-    model.set_custom_forcing_generator(
-        AsymLaplaceAmp(control_parameter=control_parameter)
-    )
-
-    T, S = model.make_realization()
-    forcing = model.get_last_used_forcing()
-    amp = forcing.amplitudes
-
-    S_norm = (S - S.mean()) / S.std()
-
-    f, Pxx = signal.welch(x=S_norm, fs=100, nperseg=S.size / 30)
-    ax1.semilogy(f, Pxx, label=rf"$\lambda = {control_parameter}$", c=color)
-
-    fitrange = find_peaks(Pxx[(f < 1)], distance=500, height=[5e-4, 1e3])[0]
-    ax1.semilogy(f[fitrange][1:], Pxx[fitrange][1:], "o", c=color)
+def render(*results, control_parameters):
+    axes_size = cosmoplots.set_rcparams_dynamo(plt.rcParams, num_cols=1, ls="thin")
 
-    tb, R = corr_fun(S_norm, S_norm, dt=0.01, norm=False, biased=True, method="auto")
-    ax2.plot(tb, R, label=rf"$\lambda = {control_parameter}$", c=color)
+    fig_PSD = plt.figure()
+    ax1 = fig_PSD.add_axes(axes_size)
+    fig_AC = plt.figure()
+    ax2 = fig_AC.add_axes(axes_size)
 
-ax1.set_xlim(-0.2, 12)
-ax1.set_ylim(1e-14, 1e3)
-ax1.set_xlabel(r"$\tau_\mathrm{d} f$")
-ax1.set_ylabel(r"$S_{\widetilde{\Phi}}(\tau_\mathrm{d} f)$")
+    plot_colors = ["tab:blue", "tab:orange", "tab:green", "tab:red"]
 
-ax1.legend()
-ax1.set_xlim(-0.03, 1)
-ax1.set_ylim(1e-4, 1e3)
-ax2.set_xlim(0, 50)
-ax2.set_xlabel(r"$t/\tau_\mathrm{d}$")
-ax2.set_ylabel(r"$R_{\widetilde{\Phi}}(t/\tau_\mathrm{d})$")
-ax2.legend()
-cosmoplots.change_log_axis_base(ax1, "y", base=10)
+    for i, (control_parameter, color) in enumerate(
+        zip(control_parameters, plot_colors)
+    ):
+        (f, Pxx), (tb, R) = results[2 * i : 2 * i + 2]
+        ax1.semilogy(f, Pxx, label=rf"$\lambda = {control_parameter}$", c=color)
+
+        fitrange = find_peaks(Pxx[(f < 1)], distance=500, height=[5e-4, 1e3])[0]
+        ax1.semilogy(f[fitrange][1:], Pxx[fitrange][1:], "o", c=color)
+
+        ax2.plot(tb, R, label=rf"$\lambda = {control_parameter}$", c=color)
+
+    ax1.set_xlim(-0.2, 12)
+    ax1.set_ylim(1e-14, 1e3)
+    ax1.set_xlabel(r"$\tau_\mathrm{d} f$")
+    ax1.set_ylabel(r"$S_{\widetilde{\Phi}}(\tau_\mathrm{d} f)$")
+
+    ax1.legend()
+    ax1.set_xlim(-0.03, 1)
+    ax1.set_ylim(1e-4, 1e3)
+    ax2.set_xlim(0, 50)
+    ax2.set_xlabel(r"$t/\tau_\mathrm{d}$")
+    ax2.set_ylabel(r"$R_{\widetilde{\Phi}}(t/\tau_\mathrm{d})$")
+    ax2.legend()
+    cosmoplots.change_log_axis_base(ax1, "y", base=10)
+
+    fig_PSD.savefig("PSD_asym_lap.eps", bbox_inches="tight")
+    fig_AC.savefig("AC_asym_lap.eps", bbox_inches="tight")
+    return fig_PSD, fig_AC
+
+
+def build_pipeline(pipeline, control_parameters=(0.2, 0.4, 0.45, 0.48)):
+    """Adds the stages of figure 3 to pipeline and returns the render stage."""
+    deps = []
+    for control_parameter in control_parameters:
+        psd, acf = add_realization_branch(
+            pipeline,
+            f"fig3_lambda{control_parameter}",
+            AsymLaplaceAmp(control_parameter=control_parameter),
+            ps.LorentzShortPulseGenerator(tolerance=1e-5),
+            gamma=0.2,
+            total_duration=100000,
+            dt=0.01,
+            nseg=30,
+            maxlag=100,
+        )
+        deps += [psd, acf]
+    return pipeline.add(
+        "render_fig3",
+        render,
+        deps=deps,
+        params=dict(control_parameters=tuple(control_parameters)),
+        persist=False,
+    )
 
-fig_PSD.savefig("PSD_asym_lap.eps", bbox_inches="tight")
-fig_AC.savefig("AC_asym_lap.eps", bbox_inches="tight")
 
-plt.show()
+if __name__ == "__main__":
+    pipeline = Pipeline()
+    pipeline.run(build_pipeline(pipeline))
+    plt.show()
@@ -1,43 +1,33 @@
 import matplotlib.pyplot as plt
 import numpy as np
-from scipy import signal
 from support_functions import *
 import superposedpulses.forcing as frc
-import superposedpulses.point_model as pm
 import superposedpulses.pulse_shape as ps
 import cosmoplots
+import kernels
+import closedexpressions
 from closedexpressions import PSD_periodic_arrivals, autocorr_periodic_arrivals
-
-
-axes_size = cosmoplots.set_rcparams_dynamo(plt.rcParams, num_cols=1, ls="thin")
-
-fig_PSD = plt.figure()
-ax1 = fig_PSD.add_axes(axes_size)
-fig_AC = plt.figure()
-ax2 = fig_AC.add_axes(axes_size)
+from figure_pipeline import Pipeline, add_realization_branch
 
 
 class ForcingGammaDistribution(frc.ForcingGenerator):
     def __init__(self, beta):
         self.beta = beta
 
-    def get_forcing(self, times: np.ndarray, gamma: float) -> frc.Forcing:
+    def get_forcing(self, times: np.ndarray, gamma: float, rng=None) -> frc.Forcing:
+        rng = np.random.default_rng(rng)
         total_pulses = int(max(times) * gamma)
         waiting_times = (
-            np.random.gamma(
-                self.beta, scale=(gamma * self.beta) ** (-1), size=total_pulses
-            )
+            rng.gamma(self.beta, scale=(gamma * self.beta) ** (-1), size=total_pulses)
             * 100  # multiplied with inverse dt
         )
-        arrival_times = np.add.accumulate(waiting_times)
-        arrival_time_indx = np.rint(arrival_times).astype(int)
-        arrival_time_indx -= arrival_time_indx[0]  # set first pulse to t = 0
-        # check whether events are sampled with arrival time > times[-1]
-        number_of_overshotings = len(arrival_time_indx[arrival_time_indx > times.size])
-        total_pulses -= number_of_overshotings
-        arrival_time_indx = arrival_time_indx[arrival_time_indx < times.size]
-
-        amplitudes = np.random.default_rng().exponential(scale=1.0, size=total_pulses)
+        # set first pulse to t = 0 and drop events with arrival time > times[-1]
+        arrival_time_indx = kernels.arrival_indices(
+            waiting_times, times.size, accumulate=True
+        )
+        total_pulses = arrival_time_indx.size
+
+        amplitudes = rng.exponential(scale=1.0, size=total_pulses)
         durations = np.ones(shape=total_pulses)
 
         return frc.Forcing(
@@ -57,47 +47,89 @@ class ForcingGammaDistribution(frc.ForcingGenerator):
         pass
 
 
-model = pm.PointModel(gamma=0.2, total_duration=100000, dt=0.01)
-model.set_pulse_shape(ps.LorentzShortPulseGenerator(tolerance=1e-5))
-
-colors = ["tab:blue", "tab:orange", "tab:olive"]
-beta_label = [r"$10^3$", r"$10^2$", r"$10$"]
-for i, beta in enumerate([1000, 100, 10]):
-    model.set_custom_forcing_generator(ForcingGammaDistribution(beta=beta))
-
-    T, S = model.make_realization()
-    forcing = model.get_last_used_forcing()
-    amp = forcing.amplitudes
-
-    S_norm = (S - S.mean()) / S.std()
-
-    f, Pxx = signal.welch(x=S_norm, fs=100, nperseg=S.size / 30)
-    ax1.semilogy(f, Pxx, label=rf"$\beta =$" + beta_label[i], color=colors[i])
-
-    tb, R = corr_fun(S_norm, S_norm, dt=0.01, norm=False, biased=True, method="auto")
-    ax2.plot(tb, R, label=rf"$\beta =$" + beta_label[i], color=colors[i])
-
-
-PSD = PSD_periodic_arrivals(2 * np.pi * f, td=1, gamma=0.2, A_rms=1, A_mean=1, dt=0.01)
-ax1.semilogy(f, PSD, "--k", label=r"$S_{\widetilde{\Phi}}(\tau_\mathrm{d} f)$")
-
-t = np.linspace(0, 50, 1000)
-R_an = autocorr_periodic_arrivals(t, 0.2, 1, 1)
-ax2.plot(t, R_an, "--k", label=r"$R_{\widetilde{\Phi}}(t/\tau_\mathrm{d})$")
-
-ax1.set_xlim(-0.03, 1)
-ax1.set_ylim(1e-4, 1e2)
-ax1.set_xlabel(r"$\tau_\mathrm{d} f$")
-ax1.set_ylabel(r"$S_{\widetilde{\Phi}}(\tau_\mathrm{d} f)$")
-ax1.legend()
-
-ax2.set_xlim(0, 50)
-ax2.set_xlabel(r"$t/\tau_\mathrm{d}$")
-ax2.set_ylabel(r"$R_{\widetilde{\Phi}}(t/\tau_\mathrm{d})$")
-ax2.legend()
-cosmoplots.change_log_axis_base(ax1, "y", base=10)
-
-fig_PSD.savefig("PSD_different_gamma.eps", bbox_inches="tight")
-fig_AC.savefig("AC_different_gamma.eps", bbox_inches="tight")
-
-plt.show()
+def analytic_stage(psd):
+    f, _ = psd
+    PSD = PSD_periodic_arrivals(
+        2 * np.pi * f, td=1, gamma=0.2, A_rms=1, A_mean=1, dt=0.01
+    )
+    t = np.linspace(0, 50, 1000)
+    R_an = autocorr_periodic_arrivals(t, 0.2, 1, 1)
+    return PSD, t, R_an
+
+
+def beta_label(beta):
+    """Legend label of beta, powers of ten above 10 as 10^n."""
+    exponent = np.log10(beta)
+    if exponent > 1 and exponent == round(exponent):
+        return rf"$\beta = 10^{{{int(exponent)}}}$"
+    return rf"$\beta = {beta:g}$"
+
+
+def render(*results, betas):
+    axes_size = cosmoplots.set_rcparams_dynamo(plt.rcParams, num_cols=1, ls="thin")
+
+    fig_PSD = plt.figure()
+    ax1 = fig_PSD.add_axes(axes_size)
+    fig_AC = plt.figure()
+    ax2 = fig_AC.add_axes(axes_size)
+
+    colors = ["tab:blue", "tab:orange", "tab:olive"]
+    for i, beta in enumerate(betas):
+        (f, Pxx), (tb, R) = results[2 * i : 2 * i + 2]
+        color = colors[i % len(colors)]
+        ax1.semilogy(f, Pxx, label=beta_label(beta), color=color)
+        ax2.plot(tb, R, label=beta_label(beta), color=color)
+
+    PSD, t, R_an = results[-1]
+    ax1.semilogy(f, PSD, "--k", label=r"$S_{\widetilde{\Phi}}(\tau_\mathrm{d} f)$")
+    ax2.plot(t, R_an, "--k", label=r"$R_{\widetilde{\Phi}}(t/\tau_\mathrm{d})$")
+
+    ax1.set_xlim(-0.03, 1)
+    ax1.set_ylim(1e-4, 1e2)
+    ax1.set_xlabel(r"$\tau_\mathrm{d} f$")
+    ax1.set_ylabel(r"$S_{\widetilde{\Phi}}(\tau_\mathrm{d} f)$")
+    ax1.legend()
+
+    ax2.set_xlim(0, 50)
+    ax2.set_xlabel(r"$t/\tau_\mathrm{d}$")
+    ax2.set_ylabel(r"$R_{\widetilde{\Phi}}(t/\tau_\mathrm{d})$")
+    ax2.legend()
+    cosmoplots.change_log_axis_base(ax1, "y", base=10)
+
+    fig_PSD.savefig("PSD_different_gamma.eps", bbox_inches="tight")
+    fig_AC.savefig("AC_different_gamma.eps", bbox_inches="tight")
+    return fig_PSD, fig_AC
+
+
+def build_pipeline(pipeline, betas=(1000, 100, 10)):
+    """Adds the stages of figure 7 to pipeline and returns the render stage."""
+    deps = []
+    for beta in betas:
+        psd, acf = add_realization_branch(
+            pipeline,
+            f"fig7_beta{beta}",
+            ForcingGammaDistribution(beta=beta),
+            ps.LorentzShortPulseGenerator(tolerance=1e-5),
+            gamma=0.2,
+            total_duration=100000,
+            dt=0.01,
+            nseg=30,
+            maxlag=100,
+        )
+        deps += [psd, acf]
+    analytic = pipeline.add(
+        "analytic_fig7", analytic_stage, deps=[psd], uses=[closedexpressions]
+    )
+    return pipeline.add(
+        "render_fig7",
+        render,
+        deps=deps + [analytic],
+        params=dict(betas=tuple(betas)),
+        persist=False,
+    )
+
+
+if __name__ == "__main__":
+    pipeline = Pipeline()
+    pipeline.run(build_pipeline(pipeline))
+    plt.show()
@@ -0,0 +1,177 @@
+"""
+Estimates the forcing train of a signal composed of known pulses,
+
+    x(t) = sum_k A_k phi((t - t_k) / td),
+
+by deconvolution, as an alternative to the find_peaks forcing of create_fit
+which misses overlapping pulses. phi is the two-sided exponential of
+create_fit or a Lorentzian, both with peak value 1.
+
+The signal is processed in overlap-save blocks, so memory is bounded by the
+block size: each block is extended by the pulse radius on both sides,
+deconvolved with FFTs by Wiener-regularized division or Richardson-Lucy
+iterations, and only the events found in the central part are kept. Events
+are the peaks of the deconvolved forcing; the amplitude of an event is the
+deconvolved forcing summed over the event. The baseline of the forcing and
+the detection level are estimated once for the whole signal, from every
+(2w+1)-th sample of the unpadded forcing, so the events do not depend on the
+block size.
+"""
+
+import numpy as np
+import scipy.fft
+from scipy.signal import find_peaks
+
+import kernels
+
+
+def pulse_template(shape, td, dt, lam=0.5, tol=1e-3):
+    """
+    Use:
+        tkern, kern = pulse_template("exp", td=8, dt=1, lam=0.4)
+    Pulse with peak value 1, truncated where it drops below tol.
+
+    Input:
+        shape: 'exp' (two-sided exponential) or 'lorentz'. ..... string
+        td: Pulse duration. ..................................... float
+        dt: Time step. .......................................... float
+        lam: Asymmetry of the two-sided exponential. ............ float, 0<lam<1
+        tol: Truncation level. .................................. float
+    Output:
+        tkern: Times, symmetric around 0. ....................... (2R+1,) np.array
+        kern: Pulse. ............................................ (2R+1,) np.array
+    """
+    if shape == "exp":
+        radius = -np.log(tol) * max(lam, 1 - lam) * td
+        tkern = (
+            np.arange(-int(np.ceil(radius / dt)), int(np.ceil(radius / dt)) + 1) * dt
+        )
+        return tkern, kernels.double_exp(tkern, lam, td)
+    assert shape == "lorentz"
+    radius = td * np.sqrt(1 / tol - 1)
+    tkern = np.arange(-int(np.ceil(radius / dt)), int(np.ceil(radius / dt)) + 1) * dt
+    return tkern, 1 / (1 + (tkern / td) ** 2)
+
+
+def _richardson_lucy(segment, H, n, n_iter):
+    """Richardson-Lucy iterations for a nonnegative segment and pulse spectrum H."""
+    forcing = np.full(n, segment.mean() / H[0].real)
+    for _ in range(n_iter):
+        model = scipy.fft.irfft(scipy.fft.rfft(forcing) * H, n)
+        ratio = segment / np.maximum(model, 1e-12 * segment.max())
+        # correlation with the pulse normalized to unit area
+        forcing *= scipy.fft.irfft(scipy.fft.rfft(ratio) * H.conj(), n) / H[0].real
+    return forcing
+
+
+def deconvolve(
+    x,
+    dt,
+    td,
+    shape="exp",
+    lam=0.5,
+    method="wiener",
+    noise=1e-2,
+    n_iter=50,
+    threshold=None,
+    block_size=2**16,
+    tol=1e-3,
+):
+    """
+    Use:
+        arrival_time_indx, amplitudes = deconvolve(K, dt, td=8, lam=0.4)
+    Estimates the arrival times and amplitudes of the pulses in x in one
+    pass over overlap-save blocks, see the module docstring.
+
+    Input:
+        x: Signal, may be a memory-mapped array. ............... (N,) np.array
+        dt: Time step. ......................................... float
+        td: Pulse duration. .................................... float
+        shape: Pulse shape, see pulse_template. ................ string
+        lam: Asymmetry of the two-sided exponential. ........... float
+        method: 'wiener' or 'rl' (Richardson-Lucy, requires .... string
+                a nonnegative x).
+        noise: Wiener regularization relative to the peak ...... float
+               of |H|^2, H the transfer function of the pulse.
+        n_iter: Number of Richardson-Lucy iterations. .......... int
+        threshold: Minimal event amplitude. If None, five ...... float
+                   times the robust standard deviation of the
+                   event sums of the forcing.
+        block_size: Samples kept per block. .................... int
+        tol: Truncation level of the pulse. .................... float
+    Output:
+        arrival_time_indx: Sample index of each event. ......... (M,) int np.array
+        amplitudes: Amplitude of each event. ................... (M,) np.array
+    """
+    assert method in ("wiener", "rl")
+    _, kern = pulse_template(shape, td, dt, lam, tol)
+    radius = kern.size // 2
+    n = scipy.fft.next_fast_len(block_size + 2 * radius, real=True)
+    block_size = n - 2 * radius
+
+    # pulse centered at index 0 of the circular block
+    h = np.zeros(n)
+    h[: radius + 1], h[n - radius :] = kern[radius:], kern[:radius]
+    H = scipy.fft.rfft(h)
+    G = H.conj() / (np.abs(H) ** 2 + noise * np.max(np.abs(H) ** 2))
+    # half width of the deconvolved events, over which the forcing is summed
+    width = max(int(round(0.25 * td / dt)), 1)
+    # fraction of a Wiener-deconvolved pulse within the event, 1 for the
+    # sharp events of Richardson-Lucy
+    gain = 1.0
+    if method == "wiener":
+        response = scipy.fft.irfft(H * G, n)
+        gain = response[: width + 1].sum() + response[n - width :].sum()
+
+    # samples at multiples of stride of the forcing and its event sums, from
+    # which the baseline and the detection level are estimated
+    stride = 2 * width + 1
+    arrival_time_indx, amplitudes, samples, sample_sums = [], [], [], []
+    for start in range(0, x.shape[0], block_size):
+        stop = min(start + block_size, x.shape[0])
+        lo, hi = max(start - radius, 0), min(stop + radius, x.shape[0])
+        segment = np.asarray(x[lo:hi], dtype=float)
+        before = lo - (start - radius)
+        segment = np.pad(segment, (before, n - segment.size - before), mode="edge")
+        if method == "wiener":
+            forcing = scipy.fft.irfft(scipy.fft.rfft(segment) * G, n)
+        else:
+            assert np.all(segment >= 0), "Richardson-Lucy requires a nonnegative signal"
+            forcing = _richardson_lucy(segment, H, n, n_iter)
+        cumulative = np.concatenate(([0], np.cumsum(forcing)))
+        window_sums = (cumulative[stride:] - cumulative[:-stride]) / gain
+        # only the central part of the block, without the padding
+        central = radius + np.arange((-start) % stride, stop - start, stride)
+        samples.append(forcing[central])
+        sample_sums.append(window_sums[central - width])
+
+        # peaks in the central part of the block
+        peaks = find_peaks(forcing, distance=stride)[0]
+        peaks = peaks[(peaks >= radius) & (peaks < radius + stop - start)]
+        arrival_time_indx.append(peaks - radius + start)
+        amplitudes.append(window_sums[peaks - width])
+
+    # subtract the baseline, then keep the events above the level
+    baseline = stride * np.median(np.concatenate(samples)) / gain
+    if threshold is None:
+        sample_sums = np.concatenate(sample_sums) - baseline
+        level = 5 * 1.4826 * np.median(np.abs(sample_sums))
+    else:
+        level = threshold
+    amplitudes = np.concatenate(amplitudes) - baseline
+    keep = amplitudes > level
+    arrival_time_indx = np.concatenate(arrival_time_indx)[keep]
+    amplitudes = amplitudes[keep]
+    # an event on a block boundary can be found in both blocks, keep the larger
+    close = np.flatnonzero(np.diff(arrival_time_indx) < 2 * width + 1)
+    drop = np.where(amplitudes[close] < amplitudes[close + 1], close, close + 1)
+    keep = np.ones(arrival_time_indx.size, dtype=bool)
+    keep[drop] = False
+    return arrival_time_indx[keep], amplitudes[keep]
+
+
+def forcing_from_events(arrival_time_indx, amplitudes, size):
+    """Dense forcing with the event amplitudes at their sample indices."""
+    forcing = np.zeros(size)
+    np.add.at(forcing, arrival_time_indx, amplitudes)
+    return forcing
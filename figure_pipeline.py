@@ -0,0 +1,417 @@
+import functools
+import hashlib
+import importlib.metadata
+import inspect
+import os
+import pickle
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+from scipy import signal
+import superposedpulses.forcing as frc
+import superposedpulses.point_model as pm
+import superposedpulses.pulse_shape as ps
+import kernels
+import support_functions
+from support_functions import corr_fun, fft_setup, sample_asymm_laplace
+
+
+@functools.lru_cache(maxsize=None)
+def _module_token(module):
+    """Hash of the source of module and the version of its distribution."""
+    try:
+        source = inspect.getsource(module)
+    except (OSError, TypeError):
+        source = ""
+    # import names can differ from distribution names, e.g. superposed-pulses
+    distributions = importlib.metadata.packages_distributions()
+    names = distributions.get(module.__name__.split(".")[0], [])
+    version = ",".join(importlib.metadata.version(name) for name in names)
+    digest = hashlib.sha1(source.encode()).hexdigest()
+    return f"module:{module.__name__}:{version}:{digest}"
+
+
+def _token(obj):
+    """
+    Returns a stable string describing obj, used to build the cache key of a stage.
+    Functions and classes contribute their source code, so that editing a stage
+    invalidates its cached output and everything downstream of it. Modules
+    contribute their source and version, see _module_token.
+    """
+    if inspect.ismodule(obj):
+        return _module_token(obj)
+    if isinstance(obj, np.ndarray):
+        return (
+            "ndarray:" + hashlib.sha1(np.ascontiguousarray(obj).tobytes()).hexdigest()
+        )
+    if isinstance(obj, dict):
+        return "{" + ",".join(f"{k}:{_token(obj[k])}" for k in sorted(obj)) + "}"
+    if isinstance(obj, (list, tuple)):
+        return "(" + ",".join(_token(x) for x in obj) + ")"
+    if inspect.isfunction(obj) or inspect.isclass(obj):
+        try:
+            source = inspect.getsource(obj)
+        except (OSError, TypeError):
+            source = ""
+        # no module name: a stage must hit the cache both when its script is
+        # run directly (__main__) and when it is imported
+        return f"{obj.__qualname__}:{source}"
+    if hasattr(obj, "__dict__"):
+        return _token(type(obj)) + _token(vars(obj))
+    return repr(obj)
+
+
+class Stage:
+    """
+    A single node of a Pipeline: func(*upstream_results, **params, **options).
+    uses lists the modules and functions called by func, which are part of its
+    cache key. options, e.g. the number of FFT threads, do not change the
+    result and are not part of the cache key.
+    """
+
+    def __init__(
+        self, name, func, deps=(), params=None, persist=True, uses=(), options=None
+    ):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.params = params if params is not None else {}
+        self.persist = persist
+        self.uses = tuple(uses)
+        self.options = options if options is not None else {}
+
+
+class Pipeline:
+    """
+    Lazily evaluated DAG of figure stages (forcing, realization, PSD, ACF,
+    analytic curves, render).
+
+    Every persisted stage is stored in cache_dir under a key built from its
+    function source, the source of the modules and functions it uses, its
+    parameters and the keys of its upstream stages. A
+    stage is only recomputed if that key changes, so restyling a figure only
+    reruns the render stage, and changing e.g. a Welch parameter only reruns
+    the PSD stages and their dependants. The result of a stage stored under
+    an earlier key is removed when the new one is stored.
+
+    Stages whose dependencies are satisfied are run concurrently in a process
+    pool of max_workers processes. Stages with persist=False (typically the
+    render stage) are cheap, never cached and always run in the calling process.
+
+    Input:
+        cache_dir: Directory for persisted stage outputs. ............ str
+        max_workers: Number of worker processes, os.cpu_count() ...... int
+                     if None. 1 runs all stages in-process.
+        fft_workers: FFT threads of the PSD and ACF stages of ...... int
+                     add_realization_branch, see fft_setup.
+        fft_backend: FFT backend of these stages. .................. string
+    """
+
+    def __init__(
+        self,
+        cache_dir="./pipeline_cache",
+        max_workers=None,
+        fft_workers=None,
+        fft_backend="scipy",
+    ):
+        self.cache_dir = cache_dir
+        self.max_workers = max_workers if max_workers else os.cpu_count()
+        self.fft_workers, self.fft_backend = fft_workers, fft_backend
+        self.stages = {}
+        self._keys = {}
+        self._memo = {}
+
+    def add(
+        self, name, func, deps=(), params=None, persist=True, uses=(), options=None
+    ):
+        """Adds a stage and returns its name for use as a dependency."""
+        assert name not in self.stages, f"stage {name} already defined"
+        for dep in deps:
+            assert dep in self.stages, f"unknown dependency {dep} of stage {name}"
+        self.stages[name] = Stage(name, func, deps, params, persist, uses, options)
+        self._keys.clear()
+        return name
+
+    def key(self, name):
+        """Cache key of a stage, depending on all of its upstream stages."""
+        if name not in self._keys:
+            stage = self.stages[name]
+            description = (
+                _token(stage.func)
+                + _token(stage.uses)
+                + _token(stage.params)
+                + "".join(self.key(dep) for dep in stage.deps)
+            )
+            self._keys[name] = hashlib.sha1(description.encode()).hexdigest()
+        return self._keys[name]
+
+    def _cache_file(self, name):
+        return os.path.join(self.cache_dir, f"{name}-{self.key(name)[:16]}.pkl")
+
+    def _load(self, name):
+        key = self.key(name)
+        if key in self._memo:
+            return True
+        if not self.stages[name].persist or not os.path.exists(self._cache_file(name)):
+            return False
+        with open(self._cache_file(name), "rb") as file:
+            self._memo[key] = pickle.load(file)
+        return True
+
+    def _store(self, name, result):
+        self._memo[self.key(name)] = result
+        if self.stages[name].persist:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # written to a temporary file first, so a killed process cannot
+            # leave a truncated pickle under a valid key
+            path = f"{self._cache_file(name)}.{os.getpid()}.tmp"
+            try:
+                with open(path, "wb") as file:
+                    pickle.dump(result, file, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(path, self._cache_file(name))
+            except BaseException:
+                os.remove(path)
+                raise
+            self._prune(name)
+
+    def _prune(self, name):
+        """Removes the cached results of name stored under other keys."""
+        current = os.path.basename(self._cache_file(name))
+        for file in os.listdir(self.cache_dir):
+            key = file[len(name) + 1 : -len(".pkl")]
+            if (
+                file.startswith(f"{name}-")
+                and file.endswith(".pkl")
+                and len(key) == 16
+                and all(c in "0123456789abcdef" for c in key)
+                and file != current
+            ):
+                os.remove(os.path.join(self.cache_dir, file))
+
+    def _cached(self, name):
+        return self.key(name) in self._memo or (
+            self.stages[name].persist and os.path.exists(self._cache_file(name))
+        )
+
+    def _needed(self, targets):
+        """
+        Stages to load or evaluate for targets. The walk back from the targets
+        stops at cached stages, whose upstream stages are not loaded.
+        """
+        needed = set()
+        stack = list(targets)
+        while stack:
+            name = stack.pop()
+            if name not in needed:
+                needed.add(name)
+                if not self._cached(name):
+                    stack.extend(self.stages[name].deps)
+        return needed
+
+    def get(self, name):
+        """Returns the result of an already evaluated stage."""
+        return self._memo[self.key(name)]
+
+    def run(self, *targets):
+        """
+        Evaluates the given stages and everything they depend on, reusing
+        persisted results where possible. Returns the result of the last target.
+        """
+        targets = targets if targets else tuple(self.stages)
+        pending = self._needed(targets)
+        running = {}
+        pool = ProcessPoolExecutor(self.max_workers) if self.max_workers > 1 else None
+        try:
+            while pending or running:
+                progress = True
+                while progress:
+                    progress = False
+                    for name in sorted(pending):
+                        stage = self.stages[name]
+                        if any(
+                            dep in pending or dep in running.values()
+                            for dep in stage.deps
+                        ):
+                            continue
+                        pending.remove(name)
+                        progress = True
+                        if self._load(name):
+                            continue
+                        args = [self.get(dep) for dep in stage.deps]
+                        kwargs = {**stage.params, **stage.options}
+                        if pool is None or not stage.persist:
+                            self._store(name, stage.func(*args, **kwargs))
+                        else:
+                            running[pool.submit(stage.func, *args, **kwargs)] = name
+                if running:
+                    finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        self._store(running.pop(future), future.result())
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+        return self.get(targets[-1])
+
+
+class FixedForcing(frc.ForcingGenerator):
+    """Forcing generator returning a precomputed forcing, e.g. from forcing_stage."""
+
+    def __init__(self, forcing):
+        self.forcing = forcing
+
+    def get_forcing(self, times: np.ndarray, gamma: float) -> frc.Forcing:
+        return self.forcing
+
+    def set_amplitude_distribution(
+        self,
+        amplitude_distribution_function,
+    ):
+        pass
+
+    def set_duration_distribution(self, duration_distribution_function):
+        pass
+
+
+def forcing_stage(generator, gamma, total_duration, dt, seed):
+    """
+    Draws a forcing from generator on the time grid of pm.PointModel. The
+    random numbers are drawn from np.random.default_rng(seed), as the global
+    np.random state is identical in all forked worker processes.
+    """
+    times = np.arange(0, total_duration, dt)
+    return generator.get_forcing(times, gamma=gamma, rng=np.random.default_rng(seed))
+
+
+def realization_stage(forcing, pulse_shape, gamma, total_duration, dt):
+    """
+    Returns the signal S of a pm.PointModel realization driven by forcing.
+    The time grid np.arange(0, total_duration, dt) is not returned, so it is
+    not persisted with every realization.
+
+    For short pulses of equal duration, the pulse is evaluated once on the time
+    grid and superposed with kernels.pulse_scatter_add instead of evaluating it
+    for every pulse in the Python loop of pm.PointModel. The pulses are then
+    truncated symmetrically around the arrival time, which differs from
+    pm.PointModel only by values below the tolerance of pulse_shape.
+    """
+    durations = forcing.durations
+    if isinstance(pulse_shape, ps.ShortPulseGenerator) and np.all(
+        durations == durations[0]
+    ):
+        times = np.arange(0, total_duration, dt)
+        radius = int(pulse_shape.get_cutoff(durations[0]) / dt)
+        pulse = pulse_shape.get_pulse(np.arange(-radius, radius + 1) * dt, durations[0])
+        arrival_time_indx = np.rint(forcing.arrival_times / dt).astype(int)
+        S = kernels.pulse_scatter_add(
+            times.size, arrival_time_indx, forcing.amplitudes, pulse
+        )
+        return S
+
+    model = pm.PointModel(gamma=gamma, total_duration=total_duration, dt=dt)
+    model.set_pulse_shape(pulse_shape)
+    model.set_custom_forcing_generator(FixedForcing(forcing))
+    _, S = model.make_realization()
+    return S
+
+
+def _normalize(S, norm):
+    if norm == "standard":
+        return (S - S.mean()) / S.std()
+    if norm == "mean":
+        return S - S.mean()
+    return S
+
+
+def welch_stage(S, dt, nseg, norm="standard", workers=None, backend="scipy"):
+    """
+    Welch PSD f, Pxx of a realization, using S.size / nseg samples per segment.
+    workers and backend select the FFT threads and backend, see fft_setup.
+    """
+    S_norm = _normalize(S, norm)
+    with fft_setup(workers, backend):
+        return signal.welch(x=S_norm, fs=1 / dt, nperseg=S.size / nseg)
+
+
+def acf_stage(S, dt, norm="standard", maxlag=None, workers=None, backend="scipy"):
+    """
+    Biased autocorrelation tb, R of a realization. If maxlag is given, only
+    lags |tb| <= maxlag are kept to limit the size of the persisted result.
+    workers and backend select the FFT threads and backend, see fft_setup.
+    """
+    S_norm = _normalize(S, norm)
+    tb, R = corr_fun(
+        S_norm,
+        S_norm,
+        dt=dt,
+        norm=False,
+        biased=True,
+        method="auto",
+        workers=workers,
+        backend=backend,
+    )
+    if maxlag is not None:
+        keep = np.abs(tb) <= maxlag
+        tb, R = tb[keep], R[keep]
+    return tb, R
+
+
+def add_realization_branch(
+    pipeline,
+    label,
+    generator,
+    pulse_shape,
+    gamma,
+    total_duration,
+    dt,
+    nseg,
+    norm="standard",
+    maxlag=None,
+    seed=None,
+    workers=None,
+    backend=None,
+):
+    """
+    Adds the forcing, realization, PSD and ACF stages of one realization to
+    pipeline. Returns the names of the PSD and ACF stages. The seed of the
+    forcing is part of its cache key; if None, it is derived from label, so
+    every branch draws different random numbers and reruns are reproducible.
+    workers and backend of the FFTs of the PSD and ACF stages default to
+    fft_workers and fft_backend of pipeline and are not part of the cache key.
+    """
+    fft_options = dict(
+        workers=pipeline.fft_workers if workers is None else workers,
+        backend=pipeline.fft_backend if backend is None else backend,
+    )
+    if seed is None:
+        seed = int(hashlib.sha1(label.encode()).hexdigest()[:16], 16)
+    model_params = dict(gamma=gamma, total_duration=total_duration, dt=dt)
+    forcing = pipeline.add(
+        f"forcing_{label}",
+        forcing_stage,
+        params=dict(generator=generator, seed=seed, **model_params),
+        uses=[frc, kernels, sample_asymm_laplace],
+    )
+    realization = pipeline.add(
+        f"realization_{label}",
+        realization_stage,
+        deps=[forcing],
+        params=dict(pulse_shape=pulse_shape, **model_params),
+        uses=[frc, pm, ps, kernels],
+    )
+    psd = pipeline.add(
+        f"psd_{label}",
+        welch_stage,
+        deps=[realization],
+        params=dict(dt=dt, nseg=nseg, norm=norm),
+        uses=[signal],
+        options=fft_options,
+    )
+    acf = pipeline.add(
+        f"acf_{label}",
+        acf_stage,
+        deps=[realization],
+        params=dict(dt=dt, norm=norm, maxlag=maxlag),
+        uses=[corr_fun, support_functions._fft_correlate, fft_setup],
+        options=fft_options,
+    )
+    return psd, acf
@@ -0,0 +1,211 @@
+"""
+Tracks the drift of the burst frequency in long records of K with a sliding
+DFT, without computing a spectrum per window.
+
+For a bank of candidate fundamentals f_c around the nominal frequency f0, the
+DFTs of the last window samples at the harmonics h f_c, h = 1, ..., n_harmonics,
+are updated recursively,
+
+    Y_t(f) = Y_{t-1}(f) + x_t exp(-2 pi i f t dt) - x_{t-N} exp(-2 pi i f (t-N) dt),
+
+which costs O(1) per sample and frequency. A Hann window is applied in the
+frequency domain by combining Y at f and f -+ 1 / (N dt). The recursion is
+summed over blocks of hop samples with one matrix product, and every hop samples
+the fundamental is estimated as the candidate with the largest total power
+of its harmonics, refined by parabolic interpolation. The power of each
+harmonic is interpolated in the same way at the refined fundamental.
+
+Run from the command line, e.g.
+    python harmonic_tracker.py RB_data/K_1.6e-3_data.npy --f0 0.0108 --window 5000
+which loads K memory-mapped and saves time, f0 and power to K_1.6e-3_data_tracked.npz.
+"""
+
+import argparse
+import os
+
+import numpy as np
+
+from support_functions import uniform_time_step
+
+
+class HarmonicTracker:
+    """
+    Input:
+        dt: Time step. ............................................ float
+        f0: Nominal fundamental frequency. ........................ float
+        window: Window length in samples. ......................... int
+        hop: Samples between estimates, window // 4 if None. ..... int
+        n_harmonics: Number of harmonics. ......................... int
+        rel_range: Candidate fundamentals span f0 (1 +- rel_range). float
+        n_candidates: Number of candidate fundamentals. ........... int
+        hann: Use a Hann window instead of a rectangular one. ..... bool
+        t0: Time of the first sample. ............................. float
+
+    Feed the signal in chunks of any length with update.
+    """
+
+    def __init__(
+        self,
+        dt,
+        f0,
+        window,
+        hop=None,
+        n_harmonics=5,
+        rel_range=0.1,
+        n_candidates=41,
+        hann=True,
+        t0=0.0,
+    ):
+        assert window > 1 and 0 < rel_range < 1 and n_candidates >= 3
+        self.dt, self.window, self.t0 = dt, int(window), t0
+        self.hop = self.window // 4 if hop is None else int(hop)
+        self.hann = hann
+        self.candidates = f0 * (1 + np.linspace(-rel_range, rel_range, n_candidates))
+        harmonics = np.arange(1, n_harmonics + 1)[:, None] * self.candidates
+        assert np.all(harmonics < 0.5 / dt), "harmonics above the Nyquist frequency"
+        # DFTs at f - 1 / (N dt), f and f + 1 / (N dt) for the Hann window
+        shifts = np.array([-1, 0, 1]) / (self.window * dt) if hann else np.zeros(1)
+        self.freqs = harmonics[None] + shifts[:, None, None]
+        self.omega = 2 * np.pi * self.freqs.ravel() * dt
+        # phase of x_{t-N} relative to x_t
+        self._delay = np.exp(1j * self.omega * self.window)[:, None]
+
+        self._Y = np.zeros(self.omega.size, dtype=complex)
+        self._kernel = np.exp(-1j * self.omega[:, None] * np.arange(self.hop))
+        self._buffer = np.zeros(self.window)
+        self._pending = np.zeros(0)
+        self._n = 0  # samples seen so far
+        w = np.hanning(self.window + 1)[:-1] if hann else np.ones(self.window)
+        # one-sided periodogram density of the windowed segment
+        self._scale = 2 * dt / np.sum(w**2)
+
+    def update(self, chunk):
+        """
+        Adds the samples in chunk and returns the estimates of all windows
+        completed in it. Samples beyond the last multiple of hop are kept
+        for the next call.
+
+        Output:
+            time: Centers of the windows. ......................... (T,) np.array
+            f0: Fundamental frequencies. .......................... (T,) np.array
+            power: Power at the harmonics of f0, interpolated ..... (T,H) np.array
+                   between the candidates.
+        """
+        chunk = np.concatenate((self._pending, np.asarray(chunk, dtype=float)))
+        M = chunk.size // self.hop
+        L, N = M * self.hop, self.window
+        chunk, self._pending = chunk[:L], chunk[L:]
+        index = self._n + np.arange(L)
+
+        # samples leaving the window, from the ring buffer and the chunk itself
+        leaving = np.empty(L)
+        k = min(L, N)
+        leaving[:k] = self._buffer[index[:k] % N]
+        leaving[k:] = chunk[: L - k]
+        self._buffer[index[L - k :] % N] = chunk[L - k :]
+
+        # sums of the increments of the recursion over each block of hop
+        # samples, then Y at the last sample of each block
+        entering = self._kernel @ chunk.reshape(M, self.hop).T
+        leaving = self._kernel @ leaving.reshape(M, self.hop).T
+        offset = np.exp(-1j * self.omega[:, None] * index[:: self.hop])
+        Y = self._Y[:, None] + np.cumsum(
+            (entering - self._delay * leaving) * offset, axis=1
+        )
+        if M > 0:
+            self._Y = Y[:, -1]
+        self._n += L
+
+        last = index[self.hop - 1 :: self.hop]
+        full = last >= N - 1
+        return self._estimate(Y[:, full], last[full])
+
+    def _estimate(self, Y, last):
+        Y = Y.reshape(self.freqs.shape + (-1,))
+        if self.hann:
+            # phase of the window start relative to the absolute time reference
+            start = np.exp(2j * np.pi * (last - self.window + 1) / self.window)
+            Y = 0.5 * Y[1] - 0.25 * (Y[0] / start + Y[2] * start)
+        else:
+            Y = Y[0]
+        power = self._scale * np.abs(Y) ** 2  # (H, M, T)
+
+        total = power.sum(axis=0)
+        i = np.clip(np.argmax(total, axis=0), 1, self.candidates.size - 2)
+        t = np.arange(total.shape[1])
+        left, center, right = total[i - 1, t], total[i, t], total[i + 1, t]
+        denominator = left - 2 * center + right
+        shift = np.where(
+            denominator < 0,
+            0.5 * (left - right) / np.where(denominator < 0, denominator, 1),
+            0,
+        )
+        shift = np.clip(shift, -1, 1)
+        df = self.candidates[1] - self.candidates[0]
+        f0 = self.candidates[i] + shift * df
+
+        # power of every harmonic interpolated with the same parabola at f0
+        left, center, right = power[:, i - 1, t], power[:, i, t], power[:, i + 1, t]
+        power = np.maximum(
+            center
+            + 0.5 * shift * (right - left)
+            + 0.5 * shift**2 * (left - 2 * center + right),
+            0,
+        )
+
+        time = self.t0 + (last - (self.window - 1) / 2) * self.dt
+        return time, f0, power.T
+
+
+def track_harmonics(X, dt, f0, window, chunk_size=2**16, **kwargs):
+    """
+    Use:
+        K = np.load("RB_data/K_1.6e-3_data.npy", mmap_mode="r")
+        time, f, power = track_harmonics(K, 1.0, 0.0108, window=5000)
+    Runs a HarmonicTracker over X, read chunk_size samples at a time. X can
+    be a memory-mapped array or any iterable of chunks. See HarmonicTracker
+    for the other arguments and the output.
+    """
+    tracker = HarmonicTracker(dt, f0, window, **kwargs)
+    chunks = X
+    if isinstance(X, np.ndarray):
+        chunks = (X[i : i + chunk_size] for i in range(0, X.shape[0], chunk_size))
+    results = [tracker.update(chunk) for chunk in chunks]
+    time, f, power = (np.concatenate(values) for values in zip(*results))
+    return time, f, power
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("K_file")
+    parser.add_argument("--time-file", default=None)
+    parser.add_argument("--f0", type=float, required=True)
+    parser.add_argument("--window", type=int, required=True, help="in samples")
+    parser.add_argument("--hop", type=int, default=None)
+    parser.add_argument("--n-harmonics", type=int, default=5)
+    parser.add_argument("--rel-range", type=float, default=0.1)
+    parser.add_argument("--chunk-size", type=int, default=2**16)
+    args = parser.parse_args()
+
+    K = np.load(args.K_file, mmap_mode="r")
+    dt, t0 = 1.0, 0.0
+    if args.time_file is not None:
+        time = np.load(args.time_file, mmap_mode="r")
+        # the phases of the sliding DFT are only valid for uniform sampling
+        dt, t0 = uniform_time_step(time), float(time[0])
+        if dt is None:
+            parser.error(f"{args.time_file} is not uniformly spaced")
+    time, f, power = track_harmonics(
+        K,
+        dt,
+        args.f0,
+        args.window,
+        chunk_size=args.chunk_size,
+        hop=args.hop,
+        n_harmonics=args.n_harmonics,
+        rel_range=args.rel_range,
+        t0=t0,
+    )
+    np.savez(
+        os.path.splitext(args.K_file)[0] + "_tracked", time=time, f0=f, power=power
+    )
@@ -0,0 +1,201 @@
+"""
+Hot loops of the forcing generators, the pulse superposition and create_fit.
+
+Every kernel has a pure NumPy implementation and, if numba is installed, a
+compiled implementation giving the same results without the temporary arrays
+of the NumPy version. The compiled kernels are used by default; set
+kernels.BACKEND = "numpy" to force the NumPy implementations.
+"""
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+BACKEND = "numba" if numba is not None else "numpy"
+
+
+def _jit(func):
+    if numba is None:
+        return None
+    return numba.njit(cache=True)(func)
+
+
+def _double_exp_numpy(tkern, lam, td):
+    kern = np.zeros(tkern.size)
+    kern[tkern < 0] = np.exp(tkern[tkern < 0] / lam / td)
+    kern[tkern >= 0] = np.exp(-tkern[tkern >= 0] / (1 - lam) / td)
+    return kern
+
+
+def _double_exp_loop(tkern, lam, td):
+    kern = np.empty(tkern.size)
+    for i in range(tkern.size):
+        if tkern[i] < 0:
+            kern[i] = np.exp(tkern[i] / lam / td)
+        else:
+            kern[i] = np.exp(-tkern[i] / (1 - lam) / td)
+    return kern
+
+
+def _asymm_laplace_numpy(U, alpha, kappa):
+    X = np.zeros(U.size)
+    X[U > kappa] = -2 * alpha * (1 - kappa) * np.log((1 - U[U > kappa]) / (1 - kappa))
+    X[U < kappa] = 2 * alpha * kappa * np.log(U[U < kappa] / kappa)
+    return X
+
+
+def _asymm_laplace_loop(U, alpha, kappa):
+    X = np.zeros(U.size)
+    for i in range(U.size):
+        if U[i] > kappa:
+            X[i] = -2 * alpha * (1 - kappa) * np.log((1 - U[i]) / (1 - kappa))
+        elif U[i] < kappa:
+            X[i] = 2 * alpha * kappa * np.log(U[i] / kappa)
+    return X
+
+
+def _arrival_indices_numpy(arrival_times, size, accumulate):
+    if accumulate:
+        arrival_times = np.add.accumulate(arrival_times)
+    arrival_time_indx = np.rint(arrival_times).astype(np.int64)
+    arrival_time_indx -= arrival_time_indx[0]  # set first pulse to t = 0
+    return arrival_time_indx[arrival_time_indx < size]
+
+
+def _arrival_indices_loop(arrival_times, size, accumulate):
+    arrival_time_indx = np.empty(arrival_times.size, dtype=np.int64)
+    total = 0.0
+    first = 0
+    count = 0
+    for i in range(arrival_times.size):
+        if accumulate:
+            total += arrival_times[i]
+        else:
+            total = arrival_times[i]
+        indx = np.int64(np.rint(total))
+        if i == 0:
+            first = indx
+        indx -= first
+        if indx < size:
+            arrival_time_indx[count] = indx
+            count += 1
+    return arrival_time_indx[:count]
+
+
+def _pulse_scatter_add_numpy(size, arrival_time_indx, amplitudes, pulse):
+    radius = pulse.size // 2
+    result = np.zeros(size)
+    for indx, amplitude in zip(arrival_time_indx, amplitudes):
+        start, stop = max(indx - radius, 0), min(indx + radius + 1, size)
+        result[start:stop] += (
+            amplitude * pulse[start - indx + radius : stop - indx + radius]
+        )
+    return result
+
+
+def _pulse_scatter_add_loop(size, arrival_time_indx, amplitudes, pulse):
+    radius = pulse.size // 2
+    result = np.zeros(size)
+    for k in range(arrival_time_indx.size):
+        indx = arrival_time_indx[k]
+        start, stop = max(indx - radius, 0), min(indx + radius + 1, size)
+        # loop over views, which numba vectorizes, instead of indexing result
+        window = result[start:stop]
+        shape = pulse[start - indx + radius : stop - indx + radius]
+        amplitude = amplitudes[k]
+        for i in range(window.size):
+            window[i] += amplitude * shape[i]
+    return result
+
+
+_double_exp_numba = _jit(_double_exp_loop)
+_asymm_laplace_numba = _jit(_asymm_laplace_loop)
+_arrival_indices_numba = _jit(_arrival_indices_loop)
+_pulse_scatter_add_numba = _jit(_pulse_scatter_add_loop)
+
+
+def _use_numba():
+    assert BACKEND in ("numba", "numpy")
+    return BACKEND == "numba" and numba is not None
+
+
+def double_exp(tkern, lam, td):
+    """
+    Two-sided exponential pulse with asymmetry lam and duration td.
+
+    Input:
+        tkern: Times at which the pulse is evaluated. ......... (N,) np.array
+        lam: Asymmetry parameter. ............................. float, 0<lam<1
+        td: Pulse duration. ................................... float
+    Output:
+        kern: exp(t/(lam td)) for t<0, exp(-t/((1-lam) td)) ... (N,) np.array
+              for t>=0.
+    """
+    tkern = np.asarray(tkern, dtype=float)
+    if _use_numba():
+        return _double_exp_numba(tkern, float(lam), float(td))
+    return _double_exp_numpy(tkern, lam, td)
+
+
+def asymm_laplace_transform(U, alpha, kappa):
+    """
+    Inverse CDF of the asymmetric Laplace distribution, see
+    support_functions.sample_asymm_laplace.
+
+    Input:
+        U: Uniformly distributed samples on (0, 1). ............ (N,) np.array
+        alpha: scale parameter. ................................ float, alpha>0
+        kappa: shape (asymmetry) parameter ..................... float, 0<=kappa<=1
+    Output:
+        X: Asymmetric Laplace distributed samples. ............. (N,) np.array
+    """
+    U = np.atleast_1d(np.asarray(U, dtype=float))
+    if _use_numba():
+        return _asymm_laplace_numba(U, float(alpha), float(kappa))
+    return _asymm_laplace_numpy(U, alpha, kappa)
+
+
+def arrival_indices(arrival_times, size, accumulate=False):
+    """
+    Converts arrival times in units of the time step to sample indices: rounds
+    them, sets the first pulse to index 0 and removes pulses with index >= size.
+
+    Input:
+        arrival_times: Arrival times, or waiting times if ..... (N,) np.array
+                       accumulate is True, in units of dt.
+        size: Number of samples of the signal. ................ int
+        accumulate: Cumulatively sum arrival_times first. ..... bool
+    Output:
+        arrival_time_indx: Indices of the remaining pulses. ... (M,) np.array
+    """
+    arrival_times = np.asarray(arrival_times, dtype=float)
+    if _use_numba():
+        return _arrival_indices_numba(arrival_times, int(size), bool(accumulate))
+    return _arrival_indices_numpy(arrival_times, size, accumulate)
+
+
+def pulse_scatter_add(size, arrival_time_indx, amplitudes, pulse):
+    """
+    Superposes the pulse template, centered at arrival_time_indx and scaled by
+    amplitudes, on a signal of size samples. Pulses are truncated at the edges.
+
+    Input:
+        size: Number of samples of the signal. ................ int
+        arrival_time_indx: Sample index of each pulse. ........ (K,) int np.array
+        amplitudes: Amplitude of each pulse. .................. (K,) np.array
+        pulse: Pulse template of odd length, centered at ...... (L,) np.array
+               the arrival time.
+    Output:
+        result: Superposition of all pulses. .................. (size,) np.array
+    """
+    arrival_time_indx = np.asarray(arrival_time_indx, dtype=np.int64)
+    amplitudes = np.asarray(amplitudes, dtype=float)
+    pulse = np.asarray(pulse, dtype=float)
+    assert arrival_time_indx.size == amplitudes.size
+    assert pulse.size % 2 == 1
+    if _use_numba():
+        return _pulse_scatter_add_numba(int(size), arrival_time_indx, amplitudes, pulse)
+    return _pulse_scatter_add_numpy(size, arrival_time_indx, amplitudes, pulse)
@@ -0,0 +1,227 @@
+"""
+Pseudo-spectral solver for the 2D Rayleigh-Benard model of BOUT_files/rb-model.cxx,
+
+    d(n)/dt    = -[phi, n]    + kappa * Delp2(n)
+    d(vort)/dt = -[phi, vort] + DDZ(n) + mu * Delp2(vort)
+    Delp2(phi) = vort
+
+with [f, g] = df/dz dg/dx - df/dx dg/dz, Dirichlet walls n = 1 - x, vort = phi = 0
+at x = 0 and x = Lx, and periodic z. Writing n = 1 - x + theta, theta, vort and
+phi are expanded in sine series in x (on the staggered grid x = (j + 1/2) dx)
+and Fourier series in z. The Poisson equation is then a division by the
+precomputed Laplacian, diffusion is integrated exactly with the exponential
+time differencing scheme ETDRK2 and the brackets are evaluated on the grid
+with one batched transform per direction and the 2/3 dealiasing rule.
+
+K (as in BOUT_files/calculate_K.py), the Nusselt number and the mean flow
+energy are computed in-situ, so no fields are written out.
+
+Run from the command line, e.g.
+    python rb_solver.py --kappa 1.6e-3 --mu 1.6e-3 --t-end 20000
+which saves K, Nu, M and time as rb_solver_data/*_<kappa>_data.npy. Existing
+files, such as the BOUT++ data in RB_data, are only overwritten with --force.
+"""
+
+import argparse
+import os
+
+import numpy as np
+import scipy.fft
+from tqdm import tqdm
+
+
+class RBSolver:
+    """
+    Input:
+        kappa: Diffusivity. .................................... float
+        mu: Viscosity. ......................................... float
+        nx: Number of grid points between the walls. ........... int
+        nz: Number of grid points in the periodic direction. ... int
+        Lx: Distance between the walls. ........................ float
+        Lz: Periodic length. ................................... float
+        dt: Time step. ......................................... float
+        initial_noise: Amplitude of uniform noise added to ..... float
+                       n and vort, as initial_noise in BOUT.inp.
+        seed: Random seed of the initial noise. ................ int
+        workers: Number of FFT threads, see scipy.fft. ......... int
+
+    The defaults correspond to BOUT_files/BOUT.inp.
+    """
+
+    def __init__(
+        self,
+        kappa=1.6e-3,
+        mu=1.6e-3,
+        nx=124,
+        nz=124,
+        Lx=1.0,
+        Lz=1.0,
+        dt=2e-3,
+        initial_noise=1e-3,
+        seed=None,
+        workers=None,
+    ):
+        assert kappa > 0 and mu > 0 and dt > 0
+        self.kappa, self.mu = kappa, mu
+        self.nx, self.nz = nx, nz
+        self.Lx, self.Lz = Lx, Lz
+        self.dt = dt
+        self.workers = workers
+        self.t = 0.0
+
+        self.x = (np.arange(nx) + 0.5) * Lx / nx
+        self.z = np.arange(nz) * Lz / nz
+
+        # spectral operators on the (sine in x) x (Fourier in z) coefficients
+        m = np.arange(1, nx + 1)
+        self.kx = (np.pi * m / Lx)[:, None]
+        self.kz = (2 * np.pi * scipy.fft.rfftfreq(nz, Lz / nz))[None, :]
+        self.lap = -(self.kx**2) - self.kz**2
+        self.dealias = (m[:, None] <= 2 * nx / 3) & (
+            np.arange(self.kz.size)[None, :] <= nz / 3
+        )
+
+        L = np.stack([kappa * self.lap, mu * self.lap]) * dt
+        self.E = np.exp(L)
+        self.phi1 = np.expm1(L) / L
+        self.phi2 = (np.expm1(L) - L) / L**2
+
+        # initial profile of BOUT.inp, with z in [0, 2 pi) as in BOUT++
+        prng = np.random.RandomState(seed=seed)
+        X, Z = np.meshgrid(self.x, self.z, indexing="ij")
+        theta = 0.01 * np.cos(2 * np.pi * Z / Lz * np.pi / 2) * np.sin(np.pi * X / Lx)
+        theta += 2 * (prng.uniform(size=X.shape) - 0.5) * initial_noise
+        vort = 2 * (prng.uniform(size=X.shape) - 0.5) * initial_noise
+        # the dealiased modes are kept exactly zero, as decaying values would
+        # end up as slow subnormal numbers
+        self.u = self.forward(np.stack([theta, vort])) * self.dealias
+
+    def forward(self, fields):
+        """Grid values (..., nx, nz) to spectral coefficients (..., nx, nz // 2 + 1)."""
+        coefficients = scipy.fft.dst(fields, type=2, axis=-2, workers=self.workers)
+        return scipy.fft.rfft(coefficients, axis=-1, workers=self.workers)
+
+    def _inverse_sine(self, coefficients):
+        fields = scipy.fft.irfft(coefficients, self.nz, axis=-1, workers=self.workers)
+        return scipy.fft.idst(fields, type=2, axis=-2, workers=self.workers)
+
+    def gradients(self, u):
+        """Returns phi_hat and the grid values of d/dz and d/dx of phi, theta and vort."""
+        phi = u[1] / self.lap
+        S = np.stack([phi, u[0], u[1]])
+        derivatives = np.zeros((6,) + S.shape[1:], dtype=complex)
+        derivatives[:3] = 1j * self.kz * S
+        # d/dx maps sin(m pi x / Lx) to cos(m pi x / Lx), m = nx vanishes on the grid
+        derivatives[3:, 1:] = (self.kx * S)[:, :-1]
+        # one batched inverse transform in z for all six derivatives
+        fields = scipy.fft.irfft(derivatives, self.nz, axis=-1, workers=self.workers)
+        dz = scipy.fft.idst(fields[:3], type=2, axis=-2, workers=self.workers)
+        dx = scipy.fft.idct(fields[3:], type=2, axis=-2, workers=self.workers)
+        return phi, dz, dx
+
+    def nonlinear(self, u):
+        """Spectral right hand side without the diffusion terms."""
+        phi, (phi_z, theta_z, vort_z), (phi_x, theta_x, vort_x) = self.gradients(u)
+        brackets = np.stack(
+            [
+                -(phi_z * theta_x - phi_x * theta_z),
+                -(phi_z * vort_x - phi_x * vort_z),
+            ]
+        )
+        N = self.forward(brackets) * self.dealias
+        # -[phi, 1 - x] = d(phi)/dz and DDZ(n) = d(theta)/dz
+        N[0] += 1j * self.kz * phi
+        N[1] += 1j * self.kz * u[0]
+        return N
+
+    def step(self):
+        """Advances the state by dt with ETDRK2."""
+        Nu = self.nonlinear(self.u)
+        a = self.E * self.u + self.dt * self.phi1 * Nu
+        self.u = a + self.dt * self.phi2 * (self.nonlinear(a) - Nu)
+        self.t += self.dt
+
+    def diagnostics(self):
+        """
+        Output:
+            K: Energy of the fluctuating flow, 0.5 int |grad(phi - phi_0)|^2 .. float
+            Nu: Nusselt number 1 + <n v_x> / kappa, v_x = d(phi)/dz. ......... float
+            M: Energy of the mean flow, 0.5 int (d(phi_0)/dx)^2. .............. float
+        where phi_0 is the z-average of phi.
+        """
+        _, (phi_z, _, _), (phi_x, _, _) = self.gradients(self.u)
+        theta = self._inverse_sine(self.u[0])
+        area = self.Lx * self.Lz
+        mean_flow = phi_x.mean(axis=1, keepdims=True)
+        K = 0.5 * area * np.mean((phi_x - mean_flow) ** 2 + phi_z**2)
+        Nu = 1 + np.mean(theta * phi_z) / self.kappa
+        M = 0.5 * area * np.mean(mean_flow**2)
+        return K, Nu, M
+
+    def run(self, t_end, output_timestep=0.1, progress=True):
+        """
+        Integrates to t_end and records the diagnostics every output_timestep.
+
+        Output:
+            time: Output times. ................................ (T,) np.array
+            diagnostics: Dict with the K, Nu and M time series. .. dict
+        """
+        steps_per_output = max(int(round(output_timestep / self.dt)), 1)
+        n_out = int(round((t_end - self.t) / (steps_per_output * self.dt)))
+        time = np.empty(n_out)
+        diagnostics = {name: np.empty(n_out) for name in ("K", "Nu", "M")}
+        for i in tqdm(range(n_out), disable=not progress):
+            for _ in range(steps_per_output):
+                self.step()
+            time[i] = self.t
+            diagnostics["K"][i], diagnostics["Nu"][i], diagnostics["M"][i] = (
+                self.diagnostics()
+            )
+            if not np.isfinite(diagnostics["K"][i]):
+                raise FloatingPointError(
+                    f"solution diverged at t = {self.t}, reduce dt = {self.dt}"
+                )
+        return time, diagnostics
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    # kept as strings to label the output files like the data in RB_data
+    parser.add_argument("--kappa", default="1.6e-3")
+    parser.add_argument("--mu", default="1.6e-3")
+    parser.add_argument("--nx", type=int, default=124)
+    parser.add_argument("--nz", type=int, default=124)
+    parser.add_argument("--dt", type=float, default=2e-3)
+    parser.add_argument("--t-end", type=float, default=1000.0)
+    parser.add_argument("--output-timestep", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--output-dir", default="./rb_solver_data")
+    parser.add_argument(
+        "--force", action="store_true", help="overwrite existing output files"
+    )
+    args = parser.parse_args()
+
+    files = {
+        name: os.path.join(args.output_dir, f"{name}_{args.kappa}_data.npy")
+        for name in ("time", "K", "Nu", "M")
+    }
+    existing = [file for file in files.values() if os.path.exists(file)]
+    if existing and not args.force:
+        parser.error(f"{', '.join(existing)} exist, use --force to overwrite")
+
+    solver = RBSolver(
+        kappa=float(args.kappa),
+        mu=float(args.mu),
+        nx=args.nx,
+        nz=args.nz,
+        dt=args.dt,
+        seed=args.seed,
+        workers=args.workers,
+    )
+    time, diagnostics = solver.run(args.t_end, args.output_timestep)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    np.save(files["time"], time)
+    for name, values in diagnostics.items():
+        np.save(files[name], values)
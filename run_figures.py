@@ -0,0 +1,193 @@
+"""
+Headless batch entry point for all figure and spectra scripts.
+
+Examples:
+    python run_figures.py all --workers 8 --output-dir figures
+    python run_figures.py figure_4 spectra_1.6e-3 --data-dir /scratch/RB_data
+    python run_figures.py figure_4 --param figure_4:sigmas="(0.0, 0.2)"
+
+Every job runs in its own worker process with the Agg backend. Figure jobs
+share the stage cache of figure_pipeline.Pipeline in --cache-dir.
+"""
+
+import argparse
+import ast
+import importlib
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+FIGURE_JOBS = [f"figure_{n}" for n in range(2, 8)]
+SPECTRA_JOBS = {"spectra_1.6e-3": "spectra_1_6e-3", "spectra_1e-4": "spectra_1e-4"}
+JOBS = FIGURE_JOBS + list(SPECTRA_JOBS)
+
+
+def run_job(
+    job,
+    data_dir,
+    output_dir,
+    cache_dir,
+    stage_workers,
+    fft_workers,
+    fft_backend,
+    params,
+):
+    """
+    Runs a single job and returns (job, elapsed time in seconds, error message).
+    The error message is None if the job succeeded. FFTs computed in the job
+    process use fft_workers threads and fft_backend, see
+    support_functions.fft_setup.
+    """
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    from support_functions import fft_setup
+
+    start = time.perf_counter()
+    try:
+        os.makedirs(output_dir, exist_ok=True)
+        os.chdir(output_dir)
+        if job in SPECTRA_JOBS:
+            label = job.split("_")[1]
+            K_file = os.path.join(data_dir, f"K_{label}_data.npy")
+            time_file = os.path.join(data_dir, f"time_{label}_data.npy")
+            for file in (K_file, time_file):
+                if not os.path.exists(file):
+                    raise FileNotFoundError(f"missing data file {file}")
+            module = importlib.import_module(SPECTRA_JOBS[job])
+            with fft_setup(fft_workers, fft_backend):
+                module.create_figures(K_file=K_file, time_file=time_file, **params)
+        else:
+            from figure_pipeline import Pipeline
+
+            module = importlib.import_module(f"create_figure_{job.split('_')[1]}")
+            # passed to the PSD and ACF stages, as the thread-local setting of
+            # fft_setup does not carry over into the stage processes
+            pipeline = Pipeline(
+                cache_dir=cache_dir,
+                max_workers=stage_workers,
+                fft_workers=fft_workers,
+                fft_backend=fft_backend,
+            )
+            with fft_setup(fft_workers, fft_backend):
+                pipeline.run(module.build_pipeline(pipeline, **params))
+        error = None
+    except Exception:
+        error = traceback.format_exc()
+    finally:
+        plt.close("all")
+    return job, time.perf_counter() - start, error
+
+
+def _parse_params(values, jobs):
+    """Parses --param JOB:NAME=VALUE options into a dict of keyword arguments per job."""
+    params = {job: {} for job in jobs}
+    for value in values:
+        target, _, assignment = value.partition(":")
+        name, _, literal = assignment.partition("=")
+        if target not in JOBS or not name or not literal:
+            raise argparse.ArgumentTypeError(
+                f"--param expects JOB:NAME=VALUE with JOB one of {JOBS}, got {value}"
+            )
+        if target in params:
+            params[target][name] = ast.literal_eval(literal)
+    return params
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Create figures and spectra headless and in parallel."
+    )
+    parser.add_argument("jobs", nargs="+", choices=JOBS + ["all", "figures", "spectra"])
+    parser.add_argument("--data-dir", default="./RB_data")
+    parser.add_argument("--output-dir", default=".")
+    parser.add_argument("--cache-dir", default="./pipeline_cache")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=min(4, os.cpu_count()),
+        help="concurrent jobs; every figure job keeps its signals in memory, which "
+        "can take a few GB per job, so lower this if memory is short",
+    )
+    parser.add_argument(
+        "--stage-workers",
+        type=int,
+        default=1,
+        help="processes used by the stage pipeline of each figure job",
+    )
+    parser.add_argument(
+        "--fft-workers",
+        type=int,
+        default=None,
+        help="threads per FFT, -1 for all cores",
+    )
+    parser.add_argument("--fft-backend", choices=["scipy", "pyfftw"], default="scipy")
+    parser.add_argument(
+        "--param",
+        action="append",
+        default=[],
+        metavar="JOB:NAME=VALUE",
+        help="keyword argument passed to build_pipeline or create_figures of JOB",
+    )
+    args = parser.parse_args(argv)
+
+    jobs = []
+    for job in args.jobs:
+        selected = {"all": JOBS, "figures": FIGURE_JOBS, "spectra": list(SPECTRA_JOBS)}
+        for name in selected.get(job, [job]):
+            if name not in jobs:
+                jobs.append(name)
+    try:
+        params = _parse_params(args.param, jobs)
+    except (argparse.ArgumentTypeError, ValueError, SyntaxError) as error:
+        parser.error(str(error))
+
+    # workers change into the output directory, so all paths are made absolute
+    data_dir = os.path.abspath(args.data_dir)
+    output_dir = os.path.abspath(args.output_dir)
+    cache_dir = os.path.abspath(args.cache_dir)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.environ["MPLBACKEND"] = "Agg"
+
+    failed = 0
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=min(args.workers, len(jobs))) as pool:
+        futures = {
+            pool.submit(
+                run_job,
+                job,
+                data_dir,
+                output_dir,
+                cache_dir,
+                args.stage_workers,
+                args.fft_workers,
+                args.fft_backend,
+                params[job],
+            ): job
+            for job in jobs
+        }
+        for future in as_completed(futures):
+            try:
+                job, elapsed, error = future.result()
+            except Exception:
+                # the worker process died, e.g. killed when out of memory, which
+                # breaks the pool and fails the remaining jobs as well
+                job, elapsed = futures[future], time.perf_counter() - start
+                error = traceback.format_exc()
+            status = "ok" if error is None else "FAILED"
+            print(f"{job:<16} {status:<7} {elapsed:9.1f} s", flush=True)
+            if error is not None:
+                failed += 1
+                print(error, file=sys.stderr)
+    print(
+        f"{len(jobs) - failed}/{len(jobs)} jobs done in {time.perf_counter() - start:.1f} s"
+    )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,319 @@
+"""
+Atlas of normalized model spectra for matching a measured spectrum, e.g. of K,
+to the arrival models of the paper without fitting every model:
+    "periodic": periodic arrivals, as PSD_periodic_arrivals (create_figure_2.py)
+    "jitter":   Gaussian jitter sigma around periodic arrivals (create_figure_4.py)
+    "gaussian", "uniform", "gamma": renewal processes with waiting time parameter
+                sigma, kappa or beta (create_figure_5.py - create_figure_7.py)
+The continuous spectra are those of whittle.model_spectrum; the harmonic lines
+of the periodic and jittered arrivals are included with their integrated power.
+
+The spectra are averaged over logarithmic bins of theta = 2 pi f td and
+normalized by subtracting the mean of their logarithm, so they depend only on
+gamma td, the amplitude ratio A_rms / A_mean and the waiting time parameter.
+The atlas stores these features for a grid of the three parameters as .npy
+files which are memory-mapped when loaded, together with their projections on
+the leading principal components, on which a KD-tree per model is built. For
+a query, the measured spectrum is binned for a range of trial durations td,
+the nearest atlas entries of every trial are found with the KD-trees and
+ranked by the RMS difference of the full log-spectra.
+
+Run from the command line, e.g.
+    python spectrum_atlas.py atlas --build --pulse exp --lam 0.4
+    python spectrum_atlas.py atlas RB_data/K_1.6e-3_data.npy --f-max 0.2
+which builds the atlas for the pulses of create_fit in the directory atlas/ and
+prints the best matches of every model for the periodogram of K.
+"""
+
+import argparse
+import os
+
+import numpy as np
+from scipy import signal
+from scipy.spatial import cKDTree
+
+from whittle import WAITING_PARAMETER, model_spectrum, parameter_names
+
+MODELS = ("periodic", "jitter", "gaussian", "uniform", "gamma")
+GAMMA_TD = np.logspace(-2, 0.5, 51)
+A_RATIO = np.logspace(-2, 1, 31)
+# the narrowest peaks of the renewal processes are resolved with n_sub = 256
+WAITING_GRID = {
+    "jitter": np.logspace(-2, 0, 31),
+    "gaussian": np.logspace(-1.5, 0, 31),
+    "uniform": np.logspace(-1, np.log10(2), 31),
+    "gamma": np.logspace(0, 3, 31),
+}
+
+
+def _bin_spectra(gamma_td, waiting, model, pulse, lam, edges, n_sub):
+    """
+    Bin averages of the pulse spectrum |phi|^2 and of the arrival part
+    |phi|^2 R for td = 1, both divided by 2 gamma, for all waiting parameters.
+    """
+    width = np.diff(edges)
+    # midpoints of n_sub subintervals of every bin
+    theta = edges[:-1, None] + width[:, None] * (np.arange(n_sub) + 0.5) / n_sub
+    f = theta.ravel() / (2 * np.pi)
+    spectrum_model = "jitter" if model == "periodic" else model
+    names = parameter_names(spectrum_model, pulse)
+
+    def rows(A_rms, A_mean, p):
+        values = {"gamma": gamma_td, "td": 1.0, "lam": lam, "A_rms": A_rms}
+        values.update(A_mean=A_mean, **{WAITING_PARAMETER[spectrum_model]: p})
+        return np.stack(np.broadcast_arrays(*[values[name] for name in names]), -1)
+
+    with np.errstate(all="ignore"):
+        S, _ = model_spectrum(f, rows(1.0, 0.0, 1.0), spectrum_model, pulse)
+        pulse_bins = S.reshape(edges.size - 1, n_sub).mean(-1) / (2 * gamma_td)
+        S, _ = model_spectrum(f, rows(0.0, 1.0, waiting), spectrum_model, pulse)
+        arrival_bins = S.reshape(-1, edges.size - 1, n_sub).mean(-1) / (2 * gamma_td)
+
+    if model in ("periodic", "jitter"):
+        # lines at f = n gamma with power 2 gamma^2 |phi|^2 exp(-(2 pi n sigma)^2),
+        # divided by 2 gamma as the continuous spectra
+        n = np.arange(1, int(edges[-1] / (2 * np.pi * gamma_td)) + 1)
+        b = np.searchsorted(edges, 2 * np.pi * n * gamma_td) - 1
+        n, b = n[(b >= 0) & (b < width.size)], b[(b >= 0) & (b < width.size)]
+        S, _ = model_spectrum(n * gamma_td, rows(1.0, 0.0, 1.0), "jitter", pulse)
+        power = 0.5 * S * np.exp(-((2 * np.pi * n * waiting[:, None]) ** 2))
+        lines = np.zeros_like(arrival_bins)
+        for i in range(n.size):
+            lines[:, b[i]] += power[:, i]
+        arrival_bins += lines / (width / (2 * np.pi))
+    return pulse_bins, arrival_bins
+
+
+def build_atlas(
+    path,
+    pulse="lorentz",
+    lam=0.5,
+    theta_range=(0.05, 8.0),
+    n_bins=48,
+    n_sub=256,
+    n_components=12,
+    gamma_td=GAMMA_TD,
+    A_ratio=A_RATIO,
+    waiting=None,
+    seed=None,
+):
+    """
+    Use:
+        build_atlas("atlas")
+    Computes the normalized log-spectra of all models on the parameter grids
+    and writes them with the principal component scores to the directory path.
+    The spectra are written one value of gamma_td at a time to memory-mapped
+    files, so memory does not grow with the size of the grids.
+
+    Input:
+        path: Output directory. ............................... string
+        pulse: 'lorentz' or 'exp'. ............................ string
+        lam: Asymmetry of the two-sided exponential pulse. .... float
+        theta_range: Range of 2 pi f td covered by the bins. .. (2,) tuple
+        n_bins: Number of logarithmic bins. ................... int
+        n_sub: Evaluations of the spectra per bin. ............ int
+        n_components: Number of principal components. ......... int
+        gamma_td: Grid of gamma td. ........................... (G,) np.array
+        A_ratio: Grid of A_rms / A_mean. ...................... (A,) np.array
+        waiting: Grids of the waiting time parameters, ........ dict
+                 WAITING_GRID if None.
+        seed: Random seed of the rows used for the PCA. ....... int
+    """
+    waiting = {**WAITING_GRID, **({} if waiting is None else waiting)}
+    waiting["periodic"] = np.zeros(1)
+    os.makedirs(path, exist_ok=True)
+    edges = np.geomspace(theta_range[0], theta_range[1], n_bins + 1)
+    sizes = [gamma_td.size * waiting[m].size * A_ratio.size for m in MODELS]
+    offsets = np.concatenate(([0], np.cumsum(sizes)))
+
+    features = np.lib.format.open_memmap(
+        os.path.join(path, "features.npy"), "w+", np.float32, (offsets[-1], n_bins)
+    )
+    # gamma td, A_rms / A_mean and the waiting time parameter of every row
+    params = np.lib.format.open_memmap(
+        os.path.join(path, "params.npy"), "w+", float, (offsets[-1], 3)
+    )
+    for m, model in enumerate(MODELS):
+        block = waiting[model].size * A_ratio.size
+        for i, g in enumerate(gamma_td):
+            pulse_bins, arrival_bins = _bin_spectra(
+                g, waiting[model], model, pulse, lam, edges, n_sub
+            )
+            # (waiting, A_ratio, bins)
+            log_S = np.log(A_ratio[:, None] ** 2 * pulse_bins + arrival_bins[:, None])
+            log_S -= log_S.mean(-1, keepdims=True)
+            rows = slice(offsets[m] + i * block, offsets[m] + (i + 1) * block)
+            features[rows] = log_S.reshape(block, n_bins)
+            p, a = np.meshgrid(waiting[model], A_ratio, indexing="ij")
+            params[rows] = np.stack([np.full(block, g), a.ravel(), p.ravel()], -1)
+    assert np.all(np.isfinite(features)), "non-finite model spectra"
+
+    # principal components of a random subset of the rows
+    prng = np.random.default_rng(seed)
+    subset = np.sort(prng.choice(offsets[-1], min(offsets[-1], 20000), replace=False))
+    mean = features[subset].mean(0)
+    _, singular_values, components = np.linalg.svd(features[subset] - mean, False)
+    components = components[:n_components]
+    scores = np.lib.format.open_memmap(
+        os.path.join(path, "scores.npy"), "w+", np.float32, (offsets[-1], n_components)
+    )
+    for start in range(0, offsets[-1], 2**16):
+        scores[start : start + 2**16] = (
+            features[start : start + 2**16] - mean
+        ) @ components.T
+    for array in (features, params, scores):
+        array.flush()
+
+    np.savez(
+        os.path.join(path, "meta.npz"),
+        models=np.array(MODELS),
+        offsets=offsets,
+        edges=edges,
+        mean=mean,
+        components=components,
+        explained=singular_values[:n_components] ** 2 / np.sum(singular_values**2),
+        pulse=pulse,
+        lam=lam,
+    )
+
+
+class SpectrumAtlas:
+    """
+    Input:
+        path: Directory written by build_atlas. ................. string
+
+    The features are memory-mapped, only the principal component scores are
+    loaded into the KD-trees. Match spectra with query.
+    """
+
+    def __init__(self, path):
+        meta = np.load(os.path.join(path, "meta.npz"))
+        self.models = [str(model) for model in meta["models"]]
+        self.offsets = meta["offsets"]
+        self.edges = meta["edges"]
+        self.mean, self.components = meta["mean"], meta["components"]
+        self.pulse, self.lam = str(meta["pulse"]), float(meta["lam"])
+        self.features = np.load(os.path.join(path, "features.npy"), mmap_mode="r")
+        self.params = np.load(os.path.join(path, "params.npy"), mmap_mode="r")
+        scores = np.load(os.path.join(path, "scores.npy"), mmap_mode="r")
+        self.trees = {
+            model: cKDTree(scores[self.offsets[m] : self.offsets[m + 1]])
+            for m, model in enumerate(self.models)
+        }
+
+    def features_of(self, f, Pxx, td):
+        """
+        Normalized log-spectra of Pxx binned as the atlas for the durations
+        td (T,). The bin averages are differences of the cumulative integral
+        of Pxx, interpolated at the bin edges. Returns an array (T, n_bins).
+        """
+        f, Pxx = np.asarray(f, dtype=float), np.asarray(Pxx, dtype=float)
+        cumulative = np.cumsum(0.5 * np.diff(f) * (Pxx[1:] + Pxx[:-1]))
+        cumulative = np.concatenate(([0], cumulative))
+        edges = self.edges / (2 * np.pi * np.atleast_1d(td)[:, None])
+        bins = np.diff(np.interp(edges, f, cumulative), axis=-1) / np.diff(edges)
+        log_S = np.log(np.maximum(bins, 1e-300))
+        return log_S - log_S.mean(-1, keepdims=True)
+
+    def trial_durations(self, f, td_range=None, step=0.25):
+        """
+        Durations td for which the bins lie within the frequencies f and the
+        first bin is wider than the frequency resolution, spaced by step bins.
+        """
+        df = np.median(np.diff(f))
+        td_min = self.edges[-1] / (2 * np.pi * f[-1])
+        td_max = (self.edges[1] - self.edges[0]) / (2 * np.pi * df)
+        if td_range is not None:
+            td_min, td_max = max(td_min, td_range[0]), min(td_max, td_range[1])
+        assert td_min <= td_max, "frequency range too short for the atlas bins"
+        ratio = (self.edges[1] / self.edges[0]) ** step
+        return td_min * ratio ** np.arange(
+            int(np.log(td_max / td_min) / np.log(ratio)) + 1
+        )
+
+    def query(self, f, Pxx, k=5, td=None, td_range=None, per_model=False, eps=0.5):
+        """
+        Use:
+            f, Pxx = signal.periodogram(K, 1 / dt)
+            matches = SpectrumAtlas("atlas").query(f[f < 0.2], Pxx[f < 0.2])
+        Nearest atlas spectra of the spectrum Pxx. Frequencies where the
+        spectrum is dominated by noise or aliasing should be removed from f.
+
+        Input:
+            f: Increasing frequencies. ....................... (F,) np.array
+            Pxx: Spectral estimate at f. ..................... (F,) np.array
+            k: Number of matches. ............................ int
+            td: Pulse duration, scanned if None. ............. float
+            td_range: Bounds of the scanned durations. ....... (2,) tuple
+            per_model: Return the k best matches of every .... bool
+                       model instead of the k best overall.
+            eps: Relative error of the KD-tree searches, ..... float
+                 see cKDTree.query. The candidates are
+                 ranked exactly.
+        Output:
+            matches: List of dicts with 'model', 'distance' (RMS difference
+                     of the log-spectra) and the parameters 'theta' (dict of
+                     gamma, td, A_ratio = A_rms / A_mean and the waiting time
+                     parameter), sorted by distance.
+        """
+        mask = np.asarray(f) > 0
+        f, Pxx = np.asarray(f, dtype=float)[mask], np.asarray(Pxx, dtype=float)[mask]
+        td = self.trial_durations(f, td_range) if td is None else np.atleast_1d(td)
+        features = self.features_of(f, Pxx, td)
+        scores = (features - self.mean) @ self.components.T
+
+        matches = []
+        for m, model in enumerate(self.models):
+            tree = self.trees[model]
+            n = min(max(4 * k, 16), tree.n)
+            _, index = tree.query(scores, n, eps=eps)
+            # candidates of all trial durations, ranked with the full features
+            trial = np.repeat(np.arange(td.size), n)
+            rows = index.ravel() + self.offsets[m]
+            unique, inverse = np.unique(rows, return_inverse=True)
+            distance = np.sqrt(
+                np.mean(
+                    (features[trial] - self.features[unique][inverse.ravel()]) ** 2, -1
+                )
+            )
+            order = np.argsort(distance)
+            _, first = np.unique(rows[order], return_index=True)
+            best = order[np.sort(first)][:k]
+            for i in best:
+                gamma_td, A_ratio, p = self.params[rows[i]].tolist()
+                duration = float(td[trial[i]])
+                theta = {"gamma": gamma_td / duration, "td": duration}
+                theta["A_ratio"] = A_ratio
+                if model != "periodic":
+                    theta[WAITING_PARAMETER[model]] = p
+                matches.append(
+                    {"model": model, "distance": float(distance[i]), "theta": theta}
+                )
+        matches.sort(key=lambda match: match["distance"])
+        return matches if per_model else matches[:k]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("atlas")
+    parser.add_argument("K_files", nargs="*")
+    parser.add_argument("--build", action="store_true")
+    parser.add_argument("--pulse", default="lorentz")
+    parser.add_argument("--lam", type=float, default=0.5)
+    parser.add_argument("--dt", type=float, default=1.0)
+    parser.add_argument("--f-max", type=float, default=None)
+    parser.add_argument("--k", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.build:
+        build_atlas(args.atlas, pulse=args.pulse, lam=args.lam)
+    atlas = SpectrumAtlas(args.atlas)
+    for K_file in args.K_files:
+        K = np.load(K_file, mmap_mode="r")
+        # the bins of the atlas average the periodogram
+        f, Pxx = signal.periodogram((K - K.mean()) / K.std(), 1 / args.dt)
+        mask = f <= (f[-1] if args.f_max is None else args.f_max)
+        print(K_file)
+        for match in atlas.query(f[mask], Pxx[mask], k=args.k, per_model=True):
+            theta = ", ".join(f"{k}={v:.4g}" for k, v in match["theta"].items())
+            print(f"  {match['model']:9s} {match['distance']:.3f}  {theta}")
@@ -1,10 +1,63 @@
+from contextlib import contextmanager
+
 import numpy as np
+import scipy.fft
 import scipy.signal as ssi
 from scipy.optimize import minimize
 from scipy.signal import find_peaks, fftconvolve
+import deconvolution
+import kernels
+
+
+@contextmanager
+def fft_setup(workers=None, backend="scipy"):
+    """
+    Use:
+        with fft_setup(workers=-1):
+            f, Pxx = ssi.welch(...)
+    Selects the scipy.fft backend and the number of threads used by every
+    scipy.fft call in the block, including those inside ssi.welch,
+    fftconvolve and ssi.correlate.
+    Input:
+        workers: Number of threads, -1 for all cores. ............ int
+                 None keeps the current setting (1 by default).
+        backend: 'scipy' (pocketfft) or 'pyfftw'. ................ string
+
+    Both backends keep plans for recurring transform lengths in a cache,
+    so repeated transforms of the same length are only planned once.
+    """
+    if backend == "pyfftw":
+        import pyfftw.interfaces.cache
+        import pyfftw.interfaces.scipy_fft
+
+        pyfftw.interfaces.cache.enable()
+        backend = pyfftw.interfaces.scipy_fft
+    else:
+        assert backend == "scipy"
+    with scipy.fft.set_backend(backend):
+        if workers is None:
+            yield
+        else:
+            with scipy.fft.set_workers(workers):
+                yield
 
 
-def corr_fun(X, Y, dt, norm=True, biased=True, method="auto"):
+def _fft_correlate(Xn, Yn, workers=None):
+    """
+    Full cross-correlation of Xn and Yn, ordered as ssi.correlate(Xn, Yn, "full").
+    Pads to a fast FFT length and only transforms once if Yn is Xn.
+    """
+    N = Xn.size
+    nfft = scipy.fft.next_fast_len(2 * N - 1, real=True)
+    FX = scipy.fft.rfft(Xn, nfft, workers=workers)
+    FY = FX if Yn is Xn else scipy.fft.rfft(Yn, nfft, workers=workers)
+    r = scipy.fft.irfft(FX * FY.conj(), nfft, workers=workers)
+    return np.concatenate((r[nfft - (N - 1) :], r[:N]))
+
+
+def corr_fun(
+    X, Y, dt, norm=True, biased=True, method="auto", workers=None, backend="scipy"
+):
     """
     Estimates the correlation function between X and Y using ssi.correlate.
     For now, we require both signals to be of equal length.
@@ -16,12 +69,16 @@ def corr_fun(X, Y, dt, norm=True, biased=True, method="auto"):
         norm: Normalizes the correlation function to a maxima of 1 ... bool
         biased: Trigger estimator biasing. ........................... bool
         method: 'direct', 'fft' or 'auto'. Passed to ssi.correlate ... string
+        workers: Number of FFT threads, see fft_setup. ............... int
+        backend: FFT backend, see fft_setup. ......................... string
 
     For biased=True, the result is divided by X.size.
     For biased=False, the estimator is unbiased and returns the result
     divided by X.size-|k|, where k is the lag.
     The unbiased estimator diverges for large lags, and
     for small lags and large X.size, the difference is trivial.
+    If the FFT method is used, the signals are padded to a fast FFT length
+    and an autocorrelation (X is Y) only needs a single forward transform.
     """
 
     assert X.size == Y.size
@@ -33,7 +90,15 @@ def corr_fun(X, Y, dt, norm=True, biased=True, method="auto"):
         Xn = X
         Yn = Y
 
-    R = ssi.correlate(Xn, Yn, mode="full", method=method)
+    if Y is X:
+        Yn = Xn
+    if method == "auto":
+        method = ssi.choose_conv_method(Xn, Yn, mode="full")
+    if method == "fft":
+        with fft_setup(workers, backend):
+            R = _fft_correlate(Xn, Yn)
+    else:
+        R = ssi.correlate(Xn, Yn, mode="full", method=method)
 
     k = np.arange(-(X.size - 1), X.size)
     tb = k * dt
@@ -46,6 +111,238 @@ def corr_fun(X, Y, dt, norm=True, biased=True, method="auto"):
     return tb, R
 
 
+def corr_matrix(
+    X, dt, norm=True, biased=True, maxlag=None, workers=None, backend="scipy"
+):
+    """
+    Use:
+        tb, R = corr_matrix(np.stack([K, Nu, M]), dt, maxlag=500)
+    Estimates the correlation functions between all pairs of rows of X, with
+    one forward FFT per signal rather than per pair.
+
+    Input:
+        X: Signals to be correlated, one per row. .................... (n,N) np.array
+        dt: Time step of the time series. ............................ float
+        norm: Normalizes each signal to zero mean and unit variance .. bool
+        biased: Trigger estimator biasing, see corr_fun. ............. bool
+        maxlag: Only return lags |tb| <= maxlag. All lags if None. ... float
+        workers: Number of FFT threads, see fft_setup. ............... int
+        backend: FFT backend, see fft_setup. ......................... string
+    Output:
+        tb: Time lags. ............................................... (L,) np.array
+        R: R[i, j] equals corr_fun(X[i], X[j], dt)[1] at lags tb. .... (n,n,L) np.array
+    """
+    X = np.atleast_2d(X)
+    n, N = X.shape
+    if norm:
+        X = (X - X.mean(axis=1, keepdims=True)) / X.std(axis=1, keepdims=True)
+
+    K = N - 1 if maxlag is None else min(N - 1, int(maxlag / dt))
+    k = np.arange(-K, K + 1)
+    nfft = scipy.fft.next_fast_len(2 * N - 1, real=True)
+
+    R = np.empty((n, n, k.size))
+    with fft_setup(workers, backend):
+        F = scipy.fft.rfft(X, nfft, axis=-1)
+        for i in range(n):
+            # one batched inverse transform for all pairs (i, j >= i)
+            r = scipy.fft.irfft(F[i] * F[i:].conj(), nfft, axis=-1)
+            R[i, i:] = np.concatenate((r[:, nfft - K :], r[:, : K + 1]), axis=-1)
+            R[i + 1 :, i] = R[i, i + 1 :, ::-1]
+
+    if biased:
+        R /= N
+    else:
+        R /= N - np.abs(k)
+
+    return k * dt, R
+
+
+def coherence_matrix(
+    X, fs, nperseg, noverlap=None, window="hann", workers=None, backend="scipy"
+):
+    """
+    Use:
+        f, C, Pxy = coherence_matrix(np.stack([K, Nu, M]), 1 / dt, nperseg=4096)
+    Estimates the magnitude squared coherence and the cross spectral densities
+    between all pairs of rows of X with Welch's method. Every segment of every
+    signal is transformed once; the cross spectra of all pairs are built from
+    these transforms.
+
+    Input:
+        X: Signals, one per row. ..................................... (n,N) np.array
+        fs: Sampling frequency. ...................................... float
+        nperseg: Length of each segment. ............................. int
+        noverlap: Overlap between segments, nperseg // 2 if None. .... int
+        window: Window passed to ssi.get_window. ..................... string
+        workers: Number of FFT threads, see fft_setup. ............... int
+        backend: FFT backend, see fft_setup. ......................... string
+    Output:
+        f: Frequencies. .............................................. (F,) np.array
+        C: C[i, j] equals ssi.coherence(X[i], X[j], fs, ...)[1]. ..... (n,n,F) np.array
+        Pxy: One-sided cross spectral densities, Pxy[i, i] is the .... (n,n,F) np.array
+             Welch PSD of X[i].
+    """
+    X = np.atleast_2d(X)
+    nperseg = int(nperseg)
+    noverlap = nperseg // 2 if noverlap is None else int(noverlap)
+    assert X.shape[1] >= nperseg > noverlap >= 0
+
+    win = ssi.get_window(window, nperseg)
+    segments = np.lib.stride_tricks.sliding_window_view(X, nperseg, axis=-1)
+    segments = segments[:, :: nperseg - noverlap]
+    segments = (segments - segments.mean(axis=-1, keepdims=True)) * win
+
+    with fft_setup(workers, backend):
+        F = scipy.fft.rfft(segments, axis=-1)
+    Pxy = np.einsum("isf,jsf->ijf", F.conj(), F) / segments.shape[1]
+    Pxy /= fs * (win**2).sum()
+    Pxy[..., 1 : None if nperseg % 2 else -1] *= 2
+
+    P = np.real(np.diagonal(Pxy, axis1=0, axis2=1)).T
+    C = np.abs(Pxy) ** 2 / (P[:, None, :] * P[None, :, :])
+    return scipy.fft.rfftfreq(nperseg, 1 / fs), C, Pxy
+
+
+def uniform_time_step(time, rtol=1e-6):
+    """
+    Use:
+        dt = uniform_time_step(time)
+    Checks in one vectorized pass whether time is uniformly spaced, as assumed
+    by dt = time[1] - time[0]. Restarted BOUT++ runs can have gaps or
+    repeated output times.
+    Input:
+        time: Sample times. ........................................ (N,) np.array
+        rtol: Allowed deviation of the spacings relative to dt. ..... float
+    Output:
+        dt: Time step, None if time is not uniform. ................. float
+    """
+    spacing = np.diff(np.asarray(time, dtype=float))
+    dt = (time[-1] - time[0]) / spacing.size
+    if dt > 0 and np.all(np.abs(spacing - dt) <= rtol * dt):
+        return dt
+    return None
+
+
+def _extirpolated_sums(t, y, df, n_freq, oversampling=8, order=8):
+    """
+    sum(y * exp(2 pi i f t)) for real y and f = k * df, k = 0, ..., n_freq - 1,
+    with the extirpolation of Press & Rybicki (1989): y is spread onto a
+    regular grid with Lagrange interpolation weights of the given order and
+    transformed with one FFT. The relative error is about 1e-4 at the
+    highest frequency for the defaults.
+    """
+    n_grid = scipy.fft.next_fast_len(oversampling * n_freq, real=True)
+    x = ((t - t[0]) * n_grid * df) % n_grid
+    # the order grid points around each sample, starting at index first; the
+    # grid is padded by order points which are wrapped around at the end
+    first = np.floor(x).astype(int) - (order - 1) // 2
+    offset = x - first
+    first %= n_grid
+    on_node = offset == (order - 1) // 2
+    numerator = np.prod([offset - j for j in range(order)], axis=0) * y
+    grid = np.zeros(n_grid + order)
+    for j in range(order):
+        # Lagrange weight prod_{l != j} (x - l) / (j - l)
+        denominator = np.prod([j - l for l in range(order) if l != j])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            weight = numerator / ((offset - j) * denominator)
+        weight[on_node] = y[on_node] if j == (order - 1) // 2 else 0.0
+        grid += np.bincount(first + j, weight, n_grid + order)
+    grid[:order] += grid[n_grid:]
+    grid = grid[:n_grid]
+    sums = np.conj(scipy.fft.rfft(grid)[:n_freq])
+    return sums * np.exp(2j * np.pi * df * np.arange(n_freq) * t[0])
+
+
+def lomb_scargle(time, x, df, n_freq, oversampling=8, window=None):
+    """
+    Use:
+        f, Pxx = lomb_scargle(time, K, df=1 / (time[-1] - time[0]), n_freq=K.size // 2)
+    Fast Lomb-Scargle periodogram of an irregularly sampled signal in
+    O(N log N), see _extirpolated_sums. It is scaled as a one-sided power
+    spectral density with the mean time step, so it agrees with
+    ssi.periodogram for uniformly sampled signals. If window is given, x and
+    the normalization sums are weighted with it at the sample times, as for
+    ssi.periodogram with the same window.
+    Input:
+        time: Sample times. ........................................ (N,) np.array
+        x: Signal. ................................................. (N,) np.array
+        df: Frequency spacing. ..................................... float
+        n_freq: Number of frequencies k * df, k = 1, ..., n_freq. .. int
+        oversampling: Grid points per frequency of the FFT. ........ int
+        window: Taper at the sample times, None for none. .......... (N,) np.array
+    Output:
+        f: Frequencies. ............................................ (n_freq,) np.array
+        Pxx: Power spectral density. ............................... (n_freq,) np.array
+    """
+    time = np.asarray(time, dtype=float)
+    y = np.asarray(x, dtype=float) - np.mean(x)
+    w = np.ones(y.size) if window is None else np.asarray(window, dtype=float)
+    # sums at the frequencies 0, ..., n_freq, of which 0 is dropped
+    sums = _extirpolated_sums(time, w * y, df, n_freq + 1, oversampling)[1:]
+    sums2 = _extirpolated_sums(time, w**2, 2 * df, n_freq + 1, oversampling)[1:]
+
+    # time offset tau with sum(sin(2 omega (t - tau))) = 0
+    phase = 0.5 * np.angle(sums2)
+    YC = (sums * np.exp(-1j * phase)).real
+    YS = (sums * np.exp(-1j * phase)).imag
+    CC = 0.5 * (np.sum(w**2) + np.abs(sums2))
+    SS = 0.5 * (np.sum(w**2) - np.abs(sums2))
+    power = 0.5 * (YC**2 / CC + YS**2 / np.maximum(SS, 1e-300))
+
+    mean_dt = (time[-1] - time[0]) / (time.size - 1)
+    return df * np.arange(1, n_freq + 1), 2 * mean_dt * power
+
+
+def spectrum(time, x, nperseg, rtol=1e-6, **kwargs):
+    """
+    Use:
+        f, Pxx = spectrum(time, K, nperseg=len(K) / 4)
+    Welch spectrum of x if time is uniform, see uniform_time_step. Otherwise
+    the fast Lomb-Scargle periodograms of segments of duration nperseg times
+    the mean time step, overlapping by half, are averaged, which avoids
+    interpolating the signal onto a uniform grid. The segments are tapered
+    with the Hann window of ssi.welch evaluated at the sample times, so both
+    estimates have the same leakage; a window passed in kwargs only applies
+    to ssi.welch. Repeated sample times, e.g. from restarted BOUT++ runs, are
+    merged into their mean first, and segments in gaps with fewer than 2
+    samples are left out of the average.
+    Input:
+        time: Sample times. ........................................ (N,) np.array
+        x: Signal. ................................................. (N,) np.array
+        nperseg: Samples per segment (on average). ................. int
+        rtol: Tolerance of the uniformity check. ................... float
+        kwargs: Passed to ssi.welch for uniform time. .............. dict
+    Output:
+        f: Frequencies. ............................................ (F,) np.array
+        Pxx: Power spectral density. ............................... (F,) np.array
+    """
+    time = np.asarray(time, dtype=float)
+    x = np.asarray(x, dtype=float)
+    nperseg = int(nperseg)
+    if np.any(np.diff(time) <= 0):
+        time, inverse, counts = np.unique(time, return_inverse=True, return_counts=True)
+        x = np.bincount(inverse, x) / counts
+    dt = uniform_time_step(time, rtol)
+    if dt is not None:
+        return ssi.welch(x, 1 / dt, nperseg=nperseg, **kwargs)
+
+    duration = nperseg * (time[-1] - time[0]) / (time.size - 1)
+    starts = np.arange(time[0], time[-1] - duration * (1 - 1e-9), duration / 2)
+    bounds = np.searchsorted(time, np.stack([starts, starts + duration]))
+    filled = bounds[1] - bounds[0] >= 2
+    assert np.any(filled), "no segment with at least 2 samples"
+    Pxx = 0
+    for lo, hi, start in zip(*bounds[:, filled], starts[filled]):
+        hann = np.sin(np.pi * (time[lo:hi] - start) / duration) ** 2
+        f, P = lomb_scargle(
+            time[lo:hi], x[lo:hi], 1 / duration, nperseg // 2, window=hann
+        )
+        Pxx = Pxx + P / np.sum(filled)
+    return f, Pxx
+
+
 def sample_asymm_laplace(alpha=1.0, kappa=0.5, size=None, seed=None):
     """
     Use:
@@ -72,31 +369,47 @@ def sample_asymm_laplace(alpha=1.0, kappa=0.5, size=None, seed=None):
         assert size > 0
     prng = np.random.RandomState(seed=seed)
     U = prng.uniform(size=size)
-    X = np.zeros(size)
-    X[U > kappa] = -2 * alpha * (1 - kappa) * np.log((1 - U[U > kappa]) / (1 - kappa))
-    X[U < kappa] = 2 * alpha * kappa * np.log(U[U < kappa] / kappa)
+    X = kernels.asymm_laplace_transform(U, alpha, kappa)
 
-    return X
+    return X if size else X[0]
 
 
-def create_fit(dt, normalized_data, T, td, lam=0.5, distance=200):
-    """calculates fit for K time series"""
+def create_fit(
+    dt,
+    normalized_data,
+    T,
+    td,
+    lam=0.5,
+    distance=200,
+    workers=None,
+    backend="scipy",
+    forcing="peaks",
+):
+    """
+    calculates fit for K time series. workers and backend select the FFT
+    threads and backend of the convolution, see fft_setup. fftconvolve pads
+    to a fast length, so odd lengths such as T.size + 2 * kernrad are fine.
+    forcing='peaks' places the pulses at the peaks of the data above 1,
+    forcing='deconvolve' uses the events of deconvolution.deconvolve, which
+    also resolves overlapping pulses.
+    """
 
     kernrad = 2**18
     time_kern = np.arange(-kernrad, kernrad + 1) * dt
 
-    peak_loc = find_peaks(normalized_data, height=1.0, distance=distance)[0]
-    forcing = np.zeros(T.size)
-    forcing[peak_loc] = normalized_data[peak_loc]
-
-    def double_exp(tkern, lam, td):
-        kern = np.zeros(tkern.size)
-        kern[tkern < 0] = np.exp(tkern[tkern < 0] / lam / td)
-        kern[tkern >= 0] = np.exp(-tkern[tkern >= 0] / (1 - lam) / td)
-        return kern
+    if forcing == "peaks":
+        peak_loc = find_peaks(normalized_data, height=1.0, distance=distance)[0]
+        forcing = np.zeros(T.size)
+        forcing[peak_loc] = normalized_data[peak_loc]
+    else:
+        assert forcing == "deconvolve"
+        forcing = deconvolution.forcing_from_events(
+            *deconvolution.deconvolve(normalized_data, dt, td, lam=lam), T.size
+        )
 
-    kern = double_exp(time_kern, lam, td)
+    kern = kernels.double_exp(time_kern, lam, td)
 
-    time_series_fit = fftconvolve(forcing, kern, "same")
+    with fft_setup(workers, backend):
+        time_series_fit = fftconvolve(forcing, kern, "same")
     time_series_fit = (time_series_fit - time_series_fit.mean()) / time_series_fit.std()
     return time_series_fit
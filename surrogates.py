@@ -0,0 +1,208 @@
+"""
+Surrogate data tests of the significance of spectral peaks, e.g. the harmonics
+of the burst frequency in the spectrum of K (spectra_1_6e-3.py).
+
+The null hypothesis is a signal without lines: the surrogates are Gaussian
+processes with the power spectrum of the original signal smoothed over
+background_width, so peaks narrower than background_width are removed
+("phase"), or have in addition the amplitude distribution of the original
+signal ("iaaft", iterative amplitude adjusted Fourier transform). With
+smooth=False the exact Fourier amplitudes of the original signal are kept
+and only the phases are randomized, which tests for structure beyond the
+power spectrum instead.
+
+For every surrogate only the peak contrast, the maximum of the Welch spectrum
+near each peak frequency divided by the median of the surrounding background,
+is kept.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import scipy.fft
+from scipy import signal
+from scipy.ndimage import uniform_filter1d
+
+# shared by all batches of a worker process, set by _init_worker
+_shared = {}
+
+
+def _peak_windows(f, peak_freqs, peak_width, background_width):
+    """Indices of the peak and background bins of each peak frequency."""
+    df = f[1] - f[0]
+    n_peak = max(int(round(peak_width / df)), 0)
+    n_background = max(int(round(background_width / df)), n_peak + 2)
+    center = np.rint(np.asarray(peak_freqs) / df).astype(int)
+    assert np.all(center - n_background >= 0) and np.all(
+        center + n_background < f.size
+    ), "background windows exceed the frequency range"
+    offsets = np.arange(-n_background, n_background + 1)
+    peak = center[:, None] + np.arange(-n_peak, n_peak + 1)
+    background = center[:, None] + offsets[np.abs(offsets) > n_peak]
+    return peak, background
+
+
+def peak_contrast(Pxx, peak, background):
+    """
+    Ratio of the maximum of Pxx in the peak windows to the median of Pxx in the
+    background windows, see _peak_windows.
+
+    Input:
+        Pxx: Spectra. ................................ (..., F) np.array
+        peak: Bin indices of the peaks. .............. (M, W) int np.array
+        background: Bin indices of the background. ... (M, V) int np.array
+    Output:
+        contrast: Peak contrasts. .................... (..., M) np.array
+    """
+    return Pxx[..., peak].max(axis=-1) / np.median(Pxx[..., background], axis=-1)
+
+
+def _init_worker(
+    amplitudes, random_amplitudes, sorted_values, n, fs, nperseg, peak, background
+):
+    _shared.update(
+        amplitudes=amplitudes,
+        random_amplitudes=random_amplitudes,
+        sorted_values=sorted_values,
+        n=n,
+        fs=fs,
+        nperseg=nperseg,
+        peak=peak,
+        background=background,
+    )
+
+
+def _surrogate_batch(args):
+    """Peak contrasts of batch_size surrogates with random phases from seed."""
+    seed, batch_size, method, n_iter, tol = args
+    amplitudes, n = _shared["amplitudes"], _shared["n"]
+    prng = np.random.default_rng(seed)
+
+    if _shared["random_amplitudes"]:
+        # Gaussian process with power spectrum amplitudes^2
+        coefficients = prng.normal(size=(batch_size, amplitudes.size, 2))
+        amplitudes = amplitudes * np.hypot(*coefficients.T).T / np.sqrt(2)
+    phases = np.exp(2j * np.pi * prng.uniform(size=(batch_size, amplitudes.shape[-1])))
+    phases[:, 0] = 1
+    if n % 2 == 0:
+        phases[:, -1] = np.sign(phases[:, -1].real)
+    surrogates = scipy.fft.irfft(amplitudes * phases, n, axis=-1)
+
+    if method == "iaaft":
+        sorted_values = np.broadcast_to(_shared["sorted_values"], surrogates.shape)
+        mismatch = np.inf
+        for _ in range(n_iter):
+            order = np.argsort(surrogates, axis=-1)
+            np.put_along_axis(surrogates, order, sorted_values, axis=-1)
+            spectrum = scipy.fft.rfft(surrogates, axis=-1)
+            magnitude = np.maximum(np.abs(spectrum), 1e-300)
+            # stop when the deviation from the target amplitudes improves by
+            # less than the fraction tol in all surrogates of the batch
+            new_mismatch = np.linalg.norm(magnitude - amplitudes, axis=-1)
+            converged = np.all(mismatch - new_mismatch < tol * new_mismatch)
+            mismatch = new_mismatch
+            surrogates = scipy.fft.irfft(spectrum * amplitudes / magnitude, n, axis=-1)
+            if converged:
+                break
+        order = np.argsort(surrogates, axis=-1)
+        # end with the exact amplitude distribution of the original
+        np.put_along_axis(surrogates, order, sorted_values, axis=-1)
+
+    _, Pxx = signal.welch(surrogates, _shared["fs"], nperseg=_shared["nperseg"])
+    return peak_contrast(Pxx, _shared["peak"], _shared["background"])
+
+
+def surrogate_test(
+    X,
+    fs,
+    peak_freqs,
+    n_surrogates=1000,
+    method="phase",
+    nperseg=None,
+    peak_width=None,
+    background_width=None,
+    smooth=True,
+    n_iter=50,
+    tol=1e-2,
+    batch_size=16,
+    workers=None,
+    seed=None,
+):
+    """
+    Use:
+        result = surrogate_test(K, 1 / dt, 0.0108 * np.arange(1, 6), n_surrogates=2000)
+    Significance of the peaks of the Welch spectrum of X at peak_freqs compared
+    with surrogates without lines, see the module docstring. The rfft of X is
+    computed once; the surrogates are generated and analysed in batches in
+    parallel processes and discarded after their peak contrasts are computed.
+
+    Input:
+        X: Signal. ............................................ (N,) np.array
+        fs: Sampling frequency. ............................... float
+        peak_freqs: Frequencies of the tested peaks. .......... (M,) np.array
+        n_surrogates: Number of surrogates. ................... int
+        method: 'phase' or 'iaaft'. ........................... string
+        nperseg: Welch segment length, N // 4 if None. ........ int
+        peak_width: Half width of the peak windows, ........... float
+                    one Welch bin if None.
+        background_width: Half width of the background ........ float
+                          windows, ten Welch bins if None.
+        smooth: Remove lines from the surrogate amplitudes. ... bool
+        n_iter: Maximal number of IAAFT iterations. ........... int
+        tol: Relative improvement of the IAAFT spectrum ....... float
+             below which the iterations stop.
+        batch_size: Surrogates per batch. ..................... int
+        workers: Number of processes. ......................... int
+        seed: Random seed. .................................... int
+    Output:
+        result: Dict with the Welch spectrum 'f', 'Pxx' of X, the peak
+                contrasts 'contrast' (M,) of X and 'surrogate_contrast'
+                (n_surrogates, M) of the surrogates, and the p-values
+                'p_value' (M,) of the peaks.
+    """
+    assert method in ("phase", "iaaft")
+    X = np.asarray(X, dtype=float)
+    n = X.size
+    nperseg = n // 4 if nperseg is None else int(nperseg)
+    peak_width = fs / nperseg if peak_width is None else peak_width
+    background_width = (
+        10 * fs / nperseg if background_width is None else background_width
+    )
+
+    f, Pxx = signal.welch(X, fs, nperseg=nperseg)
+    peak, background = _peak_windows(f, peak_freqs, peak_width, background_width)
+    contrast = peak_contrast(Pxx, peak, background)
+
+    # the single forward transform of the original signal
+    amplitudes = np.abs(scipy.fft.rfft(X - X.mean()))
+    if smooth:
+        # running mean of the log power, corrected for its bias of -euler_gamma
+        # for exponentially distributed periodogram values
+        width = max(int(round(2 * background_width * n / fs)), 1)
+        log_power = np.log(np.maximum(amplitudes[1:], 1e-300) ** 2)
+        power = np.exp(
+            uniform_filter1d(log_power, width, mode="nearest") + np.euler_gamma
+        )
+        amplitudes[1:] = np.sqrt(power)
+    amplitudes[0] = 0
+    sorted_values = np.sort(X - X.mean())
+
+    seeds = np.random.SeedSequence(seed).spawn(-(-n_surrogates // batch_size))
+    sizes = [batch_size] * (len(seeds) - 1) + [
+        n_surrogates - batch_size * (len(seeds) - 1)
+    ]
+    jobs = [(s, size, method, n_iter, tol) for s, size in zip(seeds, sizes)]
+    initargs = (amplitudes, smooth, sorted_values, n, fs, nperseg, peak, background)
+    with ProcessPoolExecutor(
+        workers, initializer=_init_worker, initargs=initargs
+    ) as pool:
+        surrogate_contrast = np.concatenate(list(pool.map(_surrogate_batch, jobs)))
+
+    p_value = (1 + np.sum(surrogate_contrast >= contrast, axis=0)) / (1 + n_surrogates)
+    return {
+        "f": f,
+        "Pxx": Pxx,
+        "contrast": contrast,
+        "surrogate_contrast": surrogate_contrast,
+        "p_value": p_value,
+    }
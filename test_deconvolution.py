@@ -0,0 +1,35 @@
+"""
+Checks that the events found by deconvolution.deconvolve do not depend on the
+block size. Run with
+    python -m pytest test_deconvolution.py
+"""
+
+import numpy as np
+import pytest
+
+import deconvolution
+import kernels
+
+
+@pytest.mark.parametrize("method", ["wiener", "rl"])
+def test_block_size(method):
+    rng = np.random.default_rng(0)
+    # not a multiple of either block size, so the last blocks are mostly padding
+    size, td, lam = 100_001, 8, 0.4
+    arrival_time_indx = np.sort(rng.choice(size, 700, replace=False))
+    amplitudes = rng.exponential(size=arrival_time_indx.size)
+    _, pulse = deconvolution.pulse_template("exp", td, 1.0, lam)
+    x = kernels.pulse_scatter_add(size, arrival_time_indx, amplitudes, pulse)
+    x += 0.01 * np.abs(rng.normal(size=size))
+
+    small = deconvolution.deconvolve(
+        x, 1.0, td, lam=lam, method=method, block_size=2**12
+    )
+    large = deconvolution.deconvolve(
+        x, 1.0, td, lam=lam, method=method, block_size=2**17
+    )
+    np.testing.assert_array_equal(small[0], large[0])
+    np.testing.assert_allclose(small[1], large[1], rtol=0, atol=1e-3)
+    # most of the pulses are found, and only a few spurious events
+    assert np.isin(arrival_time_indx, small[0]).mean() > 0.8
+    assert small[0].size < 1.1 * arrival_time_indx.size
@@ -0,0 +1,100 @@
+"""
+Compares the numba and NumPy implementations of the kernels in kernels.py.
+Run with
+    python -m pytest test_kernels.py
+"""
+
+import numpy as np
+import pytest
+
+import kernels
+
+pytest.importorskip("numba")
+
+
+def both_backends(monkeypatch, func, *args, **kwargs):
+    """Returns the results of func for BACKEND 'numba' and 'numpy'."""
+    results = []
+    for backend in ("numba", "numpy"):
+        monkeypatch.setattr(kernels, "BACKEND", backend)
+        results.append(func(*args, **kwargs))
+    return results
+
+
+@pytest.mark.parametrize("lam", [0.1, 0.5, 0.9])
+def test_double_exp(monkeypatch, lam):
+    tkern = np.linspace(-50, 50, 10001)
+    compiled, reference = both_backends(monkeypatch, kernels.double_exp, tkern, lam, 8)
+    np.testing.assert_allclose(compiled, reference, rtol=1e-15, atol=0)
+    assert compiled[tkern == 0] == 1
+
+
+@pytest.mark.parametrize("kappa", [0.0, 0.3, 0.5, 1.0])
+def test_asymm_laplace_transform(monkeypatch, kappa):
+    U = np.random.default_rng(0).uniform(size=10000)
+    # U == kappa maps to 0, the boundary between both branches
+    U[:3] = kappa, np.nextafter(kappa, 0), np.nextafter(kappa, 1)
+    U = U[(U > 0) & (U < 1)]
+    compiled, reference = both_backends(
+        monkeypatch, kernels.asymm_laplace_transform, U, 0.7, kappa
+    )
+    np.testing.assert_allclose(compiled, reference, rtol=1e-15, atol=0)
+    assert np.all(compiled[U == kappa] == 0)
+
+
+@pytest.mark.parametrize("accumulate", [False, True])
+def test_arrival_indices(monkeypatch, accumulate):
+    rng = np.random.default_rng(1)
+    size = 1000
+    if accumulate:
+        arrival_times = rng.exponential(10, size=200)
+    else:
+        arrival_times = np.sort(rng.uniform(0, 1.5 * size, size=200))
+    compiled, reference = both_backends(
+        monkeypatch, kernels.arrival_indices, arrival_times, size, accumulate
+    )
+    assert compiled.dtype == reference.dtype
+    np.testing.assert_array_equal(compiled, reference)
+    assert compiled[0] == 0 and compiled.max() < size
+
+
+def test_arrival_indices_edges(monkeypatch):
+    # the first pulse is at index 0, the last kept one at size - 1
+    size = 100
+    arrival_times = np.array([5.2, 5.5, 104.4, 104.6, 200.0])
+    for accumulate in (False, True):
+        times = np.diff(arrival_times, prepend=0) if accumulate else arrival_times
+        compiled, reference = both_backends(
+            monkeypatch, kernels.arrival_indices, times, size, accumulate
+        )
+        np.testing.assert_array_equal(compiled, reference)
+        np.testing.assert_array_equal(compiled, [0, 1, size - 1])
+
+
+@pytest.mark.parametrize("radius", [3, 50, 300])
+def test_pulse_scatter_add(monkeypatch, radius):
+    rng = np.random.default_rng(2)
+    size = 500
+    # pulses at both ends, and for radius 300 pulses truncated at both ends
+    arrival_time_indx = np.concatenate(([0, size - 1], rng.integers(0, size, 100)))
+    amplitudes = rng.exponential(size=arrival_time_indx.size)
+    pulse = kernels.double_exp(np.arange(-radius, radius + 1), 0.3, radius / 4)
+    compiled, reference = both_backends(
+        monkeypatch,
+        kernels.pulse_scatter_add,
+        size,
+        arrival_time_indx,
+        amplitudes,
+        pulse,
+    )
+    np.testing.assert_array_equal(compiled, reference)
+
+
+def test_pulse_scatter_add_truncated_pulse(monkeypatch):
+    # a single pulse longer than the signal, cut off on both sides
+    pulse = np.arange(1.0, 12.0)
+    compiled, reference = both_backends(
+        monkeypatch, kernels.pulse_scatter_add, 4, [1], [2.0], pulse
+    )
+    np.testing.assert_array_equal(compiled, reference)
+    np.testing.assert_array_equal(compiled, 2 * pulse[4:8])
@@ -0,0 +1,32 @@
+"""
+Tests of spectrum in support_functions.py for irregular time axes. Run with
+    python -m pytest test_support_functions.py
+"""
+
+import numpy as np
+
+from support_functions import spectrum
+
+
+def signal(size=100_000, f0=0.0108):
+    time = np.arange(size, dtype=float)
+    x = np.cos(2 * np.pi * f0 * time)
+    return time, x + np.random.default_rng(0).normal(size=size)
+
+
+def test_repeated_times():
+    # a restarted run repeats the last output times before the restart
+    time, x = signal()
+    repeated = np.r_[0:50_050, 50_000 : time.size]
+    f, Pxx = spectrum(time, x, 4096)
+    f_repeated, Pxx_repeated = spectrum(time[repeated], x[repeated], 4096)
+    np.testing.assert_array_equal(f_repeated, f)
+    np.testing.assert_array_equal(Pxx_repeated, Pxx)
+
+
+def test_gap_longer_than_segment():
+    time, x = signal()
+    keep = (time < 40_000) | (time > 50_000)
+    f, Pxx = spectrum(time[keep], x[keep], 2048)
+    assert np.all(np.isfinite(Pxx))
+    assert abs(f[np.argmax(Pxx)] - 0.0108) < 1 / 2048
@@ -0,0 +1,26 @@
+"""
+Recovery tests of whittle.fit_whittle on synthetic spectra. Run with
+    python -m pytest test_whittle.py
+"""
+
+import numpy as np
+import pytest
+
+import whittle
+
+
+@pytest.mark.parametrize("fixed", [{"A_mean": 1.0}, {"A_rms": 1.0}])
+def test_fit_with_one_amplitude_fixed(fixed):
+    truth = dict(gamma=0.2, td=1.0, A_rms=1.0, A_mean=1.0, beta=30.0)
+    names = whittle.parameter_names("gamma")
+    theta = [truth[name] for name in names]
+    f = np.linspace(0, 1, 1001)[1:]
+    S, _ = whittle.model_spectrum(f, theta, "gamma")
+    # Welch estimate averaged over 30 segments
+    Pxx = S[0] * np.random.default_rng(1).gamma(30, 1 / 30, size=f.size)
+    nll_truth = whittle.whittle_nll(f, Pxx, [theta], "gamma")[0][0]
+
+    result = whittle.fit_whittle(f, Pxx, "gamma", fixed=fixed, seed=0, workers=1)
+    assert result["nll"] < nll_truth + 1
+    for name in ("gamma", "td", "A_rms", "A_mean"):
+        assert result["theta"][name] == pytest.approx(truth[name], rel=0.1)
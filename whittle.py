@@ -0,0 +1,380 @@
+"""
+Whittle likelihood estimation of the parameters of a filtered Poisson-like
+process with periodic, jittered or renewal arrivals from its power spectrum.
+
+The one-sided power spectral density of a superposition of pulses with
+duration td, arrival rate gamma and amplitudes with mean A_mean and standard
+deviation A_rms is, with Omega = 2 pi f / gamma,
+
+    S(f) = 2 gamma |phi(2 pi f)|^2 [A_rms^2 + A_mean^2 R(Omega)],
+
+where |phi|^2 is the spectrum of the pulse shape and R depends on the arrival
+model:
+    "gaussian": renewal process, waiting times ~ N(1, sigma) / gamma (create_figure_5.py)
+    "uniform":  renewal process, waiting times ~ U(1 - kappa/2, 1 + kappa/2) / gamma (create_figure_6.py)
+    "gamma":    renewal process, waiting times ~ Gamma(beta, 1/beta) / gamma (create_figure_7.py)
+    "jitter":   arrival times (k + N(0, sigma)) / gamma (create_figure_4.py). Only the
+                continuous part 1 - exp(-sigma^2 Omega^2) is modelled, so the harmonics
+                f = n gamma have to be removed with harmonic_mask.
+For the renewal processes, R = Re[(1 + c) / (1 - c)] with c the characteristic
+function of the waiting times. The "gaussian" model reproduces spectra_analytical
+of create_figure_5.py.
+
+The pulse shapes are
+    "lorentz": phi(t) = 1 / (pi (1 + (t/td)^2)), as LorentzShortPulseGenerator,
+    "exp":     two-sided exponential of create_fit with asymmetry lam.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy.optimize import minimize
+
+WAITING_PARAMETER = {
+    "gaussian": "sigma",
+    "uniform": "kappa",
+    "gamma": "beta",
+    "jitter": "sigma",
+}
+
+
+def parameter_names(model, pulse="lorentz"):
+    """Names of the parameters of model, in the order used by model_spectrum."""
+    assert model in WAITING_PARAMETER
+    assert pulse in ("lorentz", "exp")
+    names = ["gamma", "td"] + (["lam"] if pulse == "exp" else [])
+    return names + ["A_rms", "A_mean", WAITING_PARAMETER[model]]
+
+
+def _pulse_spectrum(omega, td, lam, pulse):
+    """|phi|^2 and the derivatives of log|phi|^2 with respect to td and lam."""
+    if pulse == "lorentz":
+        P = td**2 * np.exp(-2 * td * np.abs(omega))
+        return P, 2 / td - 2 * np.abs(omega), np.zeros_like(P)
+    x1, x2 = lam * td * omega, (1 - lam) * td * omega
+    D1, D2 = 1 + x1**2, 1 + x2**2
+    P = td**2 / (D1 * D2)
+    dlogP_dtd = 2 / td - 2 * x1**2 / (td * D1) - 2 * x2**2 / (td * D2)
+    dlogP_dlam = -2 * x1 * td * omega / D1 + 2 * x2 * td * omega / D2
+    return P, dlogP_dtd, dlogP_dlam
+
+
+def _arrival_factor(Omega, p, model):
+    """R(Omega; p) and its derivatives with respect to Omega and p."""
+    if model == "jitter":
+        e = np.exp(-(p**2) * Omega**2)
+        return 1 - e, 2 * p**2 * Omega * e, 2 * p * Omega**2 * e
+
+    # renewal processes, characteristic function c = rho exp(i psi). 1 - rho
+    # and 1 - rho^2 are computed without cancellation, as rho -> 1 for
+    # narrow waiting time distributions
+    if model == "gaussian":
+        log_rho = -(p**2) * Omega**2 / 2
+        rho, one_minus_rho = np.exp(log_rho), -np.expm1(log_rho)
+        psi = Omega
+        rho_O, rho_p = -(p**2) * Omega * rho, -p * Omega**2 * rho
+        psi_O, psi_p = np.ones_like(Omega), np.zeros_like(Omega)
+    elif model == "uniform":
+        x = p * Omega / 2
+        rho = np.sinc(x / np.pi)
+        small = np.abs(x) < 1e-3
+        x_safe = np.where(small, 1.0, x)
+        one_minus_rho = np.where(small, x**2 / 6 - x**4 / 120, 1 - rho)
+        drho = np.where(
+            small, -x / 3, (x_safe * np.cos(x_safe) - np.sin(x_safe)) / x_safe**2
+        )
+        psi = Omega
+        rho_O, rho_p = drho * p / 2, drho * Omega / 2
+        psi_O, psi_p = np.ones_like(Omega), np.zeros_like(Omega)
+    else:
+        q = p**2 + Omega**2
+        log_rho = -p / 2 * np.log1p(Omega**2 / p**2)
+        rho, one_minus_rho = np.exp(log_rho), -np.expm1(log_rho)
+        psi = p * np.arctan(Omega / p)
+        rho_O = -rho * Omega * p / q
+        rho_p = rho * (-0.5 * np.log1p(Omega**2 / p**2) + Omega**2 / q)
+        psi_O = p**2 / q
+        psi_p = np.arctan(Omega / p) - Omega * p / q
+
+    # R = (1 - rho^2) / D, D = |1 - c|^2
+    one_minus_rho2 = one_minus_rho * (1 + rho)
+    sin2 = np.sin(psi / 2) ** 2
+    D = one_minus_rho**2 + 4 * rho * sin2
+    R = one_minus_rho2 / D
+    R_rho = (-2 * rho * D - one_minus_rho2 * (4 * sin2 - 2 * one_minus_rho)) / D**2
+    R_psi = -one_minus_rho2 * 2 * rho * np.sin(psi) / D**2
+    return R, R_rho * rho_O + R_psi * psi_O, R_rho * rho_p + R_psi * psi_p
+
+
+def model_spectrum(f, theta, model, pulse="lorentz"):
+    """
+    Use:
+        S, dS = model_spectrum(f, theta, "gaussian")
+    One-sided model PSD for a batch of parameter vectors and its analytic gradient.
+
+    Input:
+        f: Frequencies. ..................................... (F,) np.array
+        theta: Parameters ordered as parameter_names. ........ (B,P) np.array
+        model: Arrival model, see module docstring. ......... string
+        pulse: 'lorentz' or 'exp'. .......................... string
+    Output:
+        S: Model spectra. ................................... (B,F) np.array
+        dS: Derivatives of S with respect to theta. ......... (B,P,F) np.array
+    """
+    theta = np.atleast_2d(theta)
+    columns = dict(zip(parameter_names(model, pulse), theta.T[:, :, None]))
+    gamma, td = columns["gamma"], columns["td"]
+    lam = columns.get("lam", 0.5)
+    A_rms, A_mean = columns["A_rms"], columns["A_mean"]
+    p = columns[WAITING_PARAMETER[model]]
+
+    omega = 2 * np.pi * np.asarray(f)[None, :]
+    Omega = omega / gamma
+    P, dlogP_dtd, dlogP_dlam = _pulse_spectrum(omega, td, lam, pulse)
+    R, R_O, R_p = _arrival_factor(Omega, p, model)
+
+    C = A_rms**2 + A_mean**2 * R
+    S = 2 * gamma * P * C
+    dS = {
+        "gamma": 2 * P * C - 2 * P * A_mean**2 * R_O * Omega,
+        "td": S * dlogP_dtd,
+        "lam": S * dlogP_dlam,
+        "A_rms": 4 * gamma * P * A_rms,
+        "A_mean": 4 * gamma * P * A_mean * R,
+        WAITING_PARAMETER[model]: 2 * gamma * P * A_mean**2 * R_p,
+    }
+    names = parameter_names(model, pulse)
+    return S, np.stack([np.broadcast_to(dS[name], S.shape) for name in names], axis=1)
+
+
+def whittle_nll(f, Pxx, theta, model, pulse="lorentz"):
+    """
+    Negative Whittle log-likelihood sum(log S + Pxx / S) and its gradient for a
+    batch of parameter vectors theta (B, P). Returns arrays of shape (B,) and (B, P).
+    """
+    S, dS = model_spectrum(f, theta, model, pulse)
+    nll = np.sum(np.log(S) + Pxx / S, axis=-1)
+    grad = np.sum(((1 - Pxx / S) / S)[:, None, :] * dS, axis=-1)
+    return nll, grad
+
+
+def harmonic_mask(f, gamma, width):
+    """Boolean mask which is False within width of the harmonics f = n * gamma, n >= 0."""
+    n = np.rint(f / gamma)
+    return np.abs(f - n * gamma) > width
+
+
+# The optimisation works on unconstrained variables u: theta = exp(u), except
+# for lam = 1 / (1 + exp(-u)) and the uniform kappa = 2 / (1 + exp(-u)).
+def _to_theta(u, names):
+    theta = np.exp(u)
+    for i, name in enumerate(names):
+        if name == "lam":
+            theta[..., i] = 1 / (1 + np.exp(-u[..., i]))
+        elif name == "kappa":
+            theta[..., i] = 2 / (1 + np.exp(-u[..., i]))
+    return theta
+
+
+def _dtheta_du(theta, names):
+    dtheta = theta.copy()
+    for i, name in enumerate(names):
+        if name == "lam":
+            dtheta[..., i] = theta[..., i] * (1 - theta[..., i])
+        elif name == "kappa":
+            dtheta[..., i] = theta[..., i] * (1 - theta[..., i] / 2)
+    return dtheta
+
+
+def _objective(u_free, f, Pxx, model, pulse, free, u_fixed):
+    """nll and gradient with respect to the free unconstrained variables."""
+    u = np.atleast_2d(u_fixed).repeat(np.atleast_2d(u_free).shape[0], axis=0)
+    u[:, free] = u_free
+    names = parameter_names(model, pulse)
+    theta = _to_theta(u, names)
+    nll, grad = whittle_nll(f, Pxx, theta, model, pulse)
+    grad = (grad * _dtheta_du(theta, names))[:, free]
+    return nll, grad
+
+
+def _local_fit(args):
+    u0, f, Pxx, model, pulse, free, u_fixed = args
+
+    def fun(u):
+        with np.errstate(all="ignore"):
+            nll, grad = _objective(u, f, Pxx, model, pulse, free, u_fixed)
+        if not np.isfinite(nll[0]):
+            return np.inf, np.zeros_like(u)
+        return nll[0], grad[0]
+
+    result = minimize(
+        fun, u0, jac=True, method="L-BFGS-B", bounds=[(-30, 30)] * len(u0)
+    )
+    return result.x, result.fun
+
+
+def _to_u(theta, name):
+    if name in ("lam", "kappa"):
+        s = theta / (2 if name == "kappa" else 1)
+        return np.log(s / (1 - s))
+    return np.log(theta)
+
+
+def _initial_guesses(f, Pxx, names, fixed, n, prng):
+    """Random unconstrained starting points spanning the observed frequency range."""
+    f_lo, f_hi = f[0], f[-1]
+    u = np.empty((n, len(names)))
+    for i, name in enumerate(names):
+        if name in fixed:
+            u[:, i] = _to_u(float(fixed[name]), name)
+        elif name == "gamma":
+            u[:, i] = prng.uniform(np.log(f_lo), np.log(f_hi), n)
+        elif name == "td":
+            u[:, i] = prng.uniform(
+                np.log(1 / (2 * np.pi * f_hi)), np.log(1 / (2 * np.pi * f_lo)), n
+            )
+        elif name in ("lam", "kappa"):
+            u[:, i] = prng.uniform(-3, 3, n)
+        elif name == "sigma":
+            u[:, i] = prng.uniform(np.log(1e-3), np.log(3), n)
+        elif name == "beta":
+            u[:, i] = prng.uniform(np.log(1), np.log(1e4), n)
+    theta = _to_theta(u, names)
+    # amplitudes of the order of the observed spectrum
+    scale = 0.5 * np.log(np.max(Pxx) / (2 * theta[:, 0] * theta[:, 1] ** 2))
+    for name in ("A_rms", "A_mean"):
+        if name not in fixed:
+            u[:, names.index(name)] = scale + prng.uniform(-3, 1, n)
+    return u
+
+
+def _fit_amplitude(S0, Z, Pxx, n_iter=40):
+    """
+    c >= 0 minimising sum(log(S0 + c Z) + Pxx / (S0 + c Z)) for every row, by a
+    golden-section search in log c. S = S0 + c Z is the spectrum with one
+    squared amplitude c free, as S is linear in A_rms^2 and A_mean^2.
+    """
+
+    def nll(log_c):
+        S = S0 + np.exp(log_c)[:, None] * Z
+        return np.sum(np.log(S) + Pxx / S, axis=-1)
+
+    # c of the order of the observed spectrum down to vanishing amplitudes
+    hi = np.log(np.mean(Pxx / Z, axis=-1)) + 2
+    lo = hi - 10
+    ratio = (np.sqrt(5) - 1) / 2
+    a, b = lo + (1 - ratio) * (hi - lo), lo + ratio * (hi - lo)
+    fa, fb = nll(a), nll(b)
+    for _ in range(n_iter):
+        left = ~(fa > fb)  # the minimum is in [lo, b], also if both are nan
+        lo, hi = np.where(left, lo, a), np.where(left, b, hi)
+        new = np.where(left, lo + (1 - ratio) * (hi - lo), lo + ratio * (hi - lo))
+        fnew = nll(new)
+        a, b, fa, fb = (
+            np.where(left, new, b),
+            np.where(left, a, new),
+            np.where(left, fnew, fb),
+            np.where(left, fa, fnew),
+        )
+    return np.exp(0.5 * (lo + hi))
+
+
+def fit_whittle(
+    f,
+    Pxx,
+    model,
+    pulse="lorentz",
+    fixed=None,
+    mask=None,
+    n_candidates=2000,
+    n_starts=8,
+    workers=None,
+    seed=None,
+):
+    """
+    Use:
+        f, Pxx = signal.welch(S_norm, fs=100, nperseg=S.size // 30)
+        result = fit_whittle(f, Pxx, "gaussian", mask=f < 1, fixed={"td": 1})
+    Fits the parameters of model to a periodogram or Welch estimate by
+    maximising the Whittle likelihood. The likelihood is evaluated for
+    n_candidates random parameter vectors in one vectorized call, and the
+    best candidates of n_starts ranges of gamma are refined with L-BFGS-B
+    and analytic gradients in parallel processes. Frequencies where the
+    sampled signal deviates from the analytic pulse spectrum, e.g. the far
+    tail of a truncated pulse, should be removed with mask.
+
+    Input:
+        f: Frequencies. ..................................... (F,) np.array
+        Pxx: Spectral estimate at f. ........................ (F,) np.array
+        model: 'gaussian', 'uniform', 'gamma' or 'jitter'. .. string
+        pulse: 'lorentz' or 'exp'. .......................... string
+        fixed: Parameters kept at the given values. ......... dict
+        mask: Frequencies used in the fit. f > 0 if None. ... (F,) bool np.array
+        n_candidates: Number of random starting points. ..... int
+        n_starts: Number of local optimisations. ............ int
+        workers: Number of processes, 1 runs in-process. .... int
+        seed: Random seed of the starting points. ........... int
+    Output:
+        result: Dict with the estimated parameters 'theta' (dict), the
+                negative log-likelihood 'nll' and the results of all
+                local optimisations 'starts' as (theta, nll) tuples.
+    """
+    f, Pxx = np.asarray(f, dtype=float), np.asarray(Pxx, dtype=float)
+    mask = f > 0 if mask is None else np.asarray(mask) & (f > 0)
+    f, Pxx = f[mask], Pxx[mask]
+    names = parameter_names(model, pulse)
+    fixed = {} if fixed is None else fixed
+    assert set(fixed) <= set(names), f"unknown parameters {set(fixed) - set(names)}"
+    free = np.array([name not in fixed for name in names])
+
+    prng = np.random.RandomState(seed=seed)
+    candidates = _initial_guesses(f, Pxx, names, fixed, n_candidates, prng)
+    u_fixed = candidates[0]
+
+    with np.errstate(all="ignore"):
+        if "A_rms" not in fixed and "A_mean" not in fixed:
+            # the likelihood is maximised over the overall scale of S by
+            # multiplying S with mean(Pxx / S), i.e. both amplitudes by its root
+            S, _ = model_spectrum(f, _to_theta(candidates, names), model, pulse)
+            scale = 0.5 * np.log(np.mean(Pxx / S, axis=-1))
+            for name in ("A_rms", "A_mean"):
+                candidates[:, names.index(name)] += scale
+        elif "A_rms" not in fixed or "A_mean" not in fixed:
+            # with one amplitude fixed the scale is not free, so the likelihood
+            # is maximised over the other amplitude instead
+            i = names.index("A_rms" if "A_rms" not in fixed else "A_mean")
+            theta = _to_theta(candidates, names)
+            S, dS = model_spectrum(f, theta, model, pulse)
+            Z = dS[:, i] / (2 * theta[:, i, None])  # dS / d(A^2)
+            c = _fit_amplitude(S - theta[:, i, None] ** 2 * Z, Z, Pxx)
+            candidates[:, i] = 0.5 * np.log(c)
+        nll, _ = _objective(candidates[:, free], f, Pxx, model, pulse, free, u_fixed)
+    nll[~np.isfinite(nll)] = np.inf
+    if "gamma" in fixed:
+        best = np.argsort(nll)[:n_starts]
+    else:
+        # the best candidate of each of n_starts bins in gamma, as the likelihood
+        # has local minima at the subharmonics and harmonics of the true rate
+        edges = np.quantile(candidates[:, 0], np.linspace(0, 1, n_starts + 1))
+        bins = np.clip(np.searchsorted(edges, candidates[:, 0]) - 1, 0, n_starts - 1)
+        best = [
+            np.flatnonzero(bins == b)[np.argmin(nll[bins == b])]
+            for b in range(n_starts)
+            if np.any(bins == b)
+        ]
+    starts = candidates[best][:, free]
+
+    jobs = [(u0, f, Pxx, model, pulse, free, u_fixed) for u0 in starts]
+    if workers == 1:
+        local = list(map(_local_fit, jobs))
+    else:
+        with ProcessPoolExecutor(workers) as pool:
+            local = list(pool.map(_local_fit, jobs))
+
+    results = []
+    for u_free, value in local:
+        u = u_fixed.copy()
+        u[free] = u_free
+        results.append((dict(zip(names, _to_theta(u, names))), value))
+    results.sort(key=lambda result: result[1])
+    return {"theta": results[0][0], "nll": results[0][1], "starts": results}